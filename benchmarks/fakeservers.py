@@ -0,0 +1,354 @@
+import argparse
+import gzip
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import xmlrpc.client
+
+"""
+Stand in servers for the benchmarks.  Emulates just enough of the Deluge JSON-RPC API, the uTorrent WebUI, rTorrent's
+XMLRPC interface and the InfluxDB write endpoint for the collector to run a full cycle against a synthetic set of
+torrents.
+
+Run on its own, it starts every server and prints their ports as a line of JSON.  The benchmark runs it in a separate
+process so serving the requests doesn't compete with the collector for the GIL
+"""
+
+
+class FakeTorrents:
+    """
+    A deterministic set of torrents.  Values are worked out from the index so nothing is stored per torrent.  Every
+    active_every'th torrent is transferring and its counters go up each time the list is requested
+    """
+    def __init__(self, count, trackers=20, active_every=20):
+
+        self.count = count
+        self.trackers = trackers
+        self.active_every = active_every
+        self.cycle = 0
+        self.lock = threading.Lock()
+
+    def advance(self):
+        with self.lock:
+            self.cycle += 1
+            return self.cycle
+
+    def is_active(self, i):
+        return i % self.active_every == 0
+
+    def torrent(self, i, cycle):
+        """
+        :param i: Index of the torrent
+        :param cycle: Number of list requests so far
+        :return: Dict of the values every fake client is built from
+        """
+
+        size = 1024 ** 3 + i
+        active = self.is_active(i)
+        downloading = active and i % (self.active_every * 2) == 0
+        downloaded = size // 2 + cycle * 4096 if downloading else size
+        uploaded = (size * (i % 5)) // 2 + (cycle * 16384 if active else 0)
+
+        return {
+            'hash': '{:040X}'.format(i),
+            'name': 'Synthetic.Torrent.{}.1080p'.format(i),
+            'size': size,
+            'downloaded': downloaded,
+            'uploaded': uploaded,
+            'progress': downloaded / size * 100,
+            'ratio': uploaded / downloaded,
+            'seeds': i % 50,
+            'state': 'Downloading' if downloading else ('Paused' if i % 7 == 3 else 'Seeding'),
+            'tracker': 'tracker{}.example.org'.format(i % self.trackers),
+            'files': i % 20 + 1,
+        }
+
+    def changed(self, i):
+        # Torrents whose values change from one list to the next
+        return self.is_active(i)
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    torrents = None
+    latency = 0
+
+    def _send(self, body, content_type='application/json', headers=None, status=200):
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.send_response(status)
+        if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers or []:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DelugeHandler(_FakeHandler):
+    """
+    Deluge WebUI JSON-RPC.  auth.login and core.get_torrents_status with or without diff
+    """
+
+    keys = {
+        'name': 'name',
+        'total_size': 'size',
+        'progress': 'progress',
+        'all_time_download': 'downloaded',
+        'total_uploaded': 'uploaded',
+        'ratio': 'ratio',
+        'total_seeds': 'seeds',
+        'state': 'state',
+        'tracker_host': 'tracker',
+        'num_files': 'files',
+    }
+    diff_started = False
+
+    def do_POST(self):
+
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        method = request['method']
+        headers = None
+
+        if method == 'auth.login':
+            result = True
+            headers = [('Set-Cookie', '_session_id=benchmark; path=/')]
+        elif method == 'core.get_torrents_status':
+            result = self._torrents_status(request['params'])
+        else:
+            result = None
+
+        body = json.dumps({'id': request['id'], 'result': result, 'error': None}).encode('utf-8')
+        self._send(body, headers=headers)
+
+    def _torrents_status(self, params):
+
+        keys = params[1] or list(self.keys)
+        diff = len(params) > 2 and params[2]
+        cycle = self.torrents.advance()
+
+        # The first diff request gets everything, after that unchanged torrents come back empty
+        full = not diff or not DelugeHandler.diff_started
+        if diff:
+            DelugeHandler.diff_started = True
+
+        result = {}
+        for i in range(self.torrents.count):
+            torrent = self.torrents.torrent(i, cycle)
+            if full:
+                result[torrent['hash']] = {key: torrent[self.keys[key]] for key in keys}
+            elif self.torrents.changed(i):
+                result[torrent['hash']] = {key: torrent[self.keys[key]] for key in keys
+                                           if key in ('all_time_download', 'total_uploaded', 'ratio', 'progress')}
+            else:
+                result[torrent['hash']] = {}
+
+        return result
+
+
+class UTorrentHandler(_FakeHandler):
+    """
+    uTorrent WebUI.  token.html, list=1 with cache IDs, getprops and getfiles
+    """
+
+    cache_id = 0
+
+    def do_GET(self):
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.endswith('/token.html'):
+            body = b"<html><div id='token' style='display:none;'>BENCHMARKTOKEN</div></html>"
+            self._send(body, content_type='text/html', headers=[('Set-Cookie', 'GUID=benchmark; path=/')])
+            return
+
+        action = query.get('action', [None])[0]
+        if 'list' in query:
+            output = self._list(query.get('cid', [None])[0])
+        elif action == 'getprops':
+            tracker = self.torrents.torrent(int(query['hash'][0], 16), 0)['tracker']
+            output = {'build': 1, 'props': [{'trackers': 'http://{}:2710/announce\r\n'.format(tracker)}]}
+        elif action == 'getfiles':
+            torrent = self.torrents.torrent(int(query['hash'][0], 16), 0)
+            files = [['file{}.mkv'.format(n), 1024, 1024, 2, 0, 0, True, -1, -1, -1, -1, -1]
+                     for n in range(torrent['files'])]
+            output = {'build': 1, 'files': [torrent['hash'], files]}
+        else:
+            output = {'build': 1}
+
+        self._send(json.dumps(output).encode('utf-8'))
+
+    def _row(self, torrent):
+
+        return [torrent['hash'], 201, torrent['name'], torrent['size'], int(torrent['progress'] * 10),
+                torrent['downloaded'], torrent['uploaded'], int(torrent['ratio'] * 1000), 0, 0, -1, '', 0, 0, 0,
+                torrent['seeds'], 0, -1, 0, '', '', torrent['state'], torrent['state']]
+
+    def _list(self, cache_id):
+
+        cycle = self.torrents.advance()
+        output = {'build': 1, 'label': []}
+
+        with self.torrents.lock:
+            full = cache_id is None or cache_id != str(UTorrentHandler.cache_id)
+            UTorrentHandler.cache_id += 1
+            output['torrentc'] = str(UTorrentHandler.cache_id)
+
+        if full:
+            output['torrents'] = [self._row(self.torrents.torrent(i, cycle)) for i in range(self.torrents.count)]
+        else:
+            output['torrentp'] = [self._row(self.torrents.torrent(i, cycle)) for i in range(self.torrents.count)
+                                  if self.torrents.changed(i)]
+            output['torrentm'] = []
+
+        return output
+
+
+class InfluxDBHandler(_FakeHandler):
+    """
+    InfluxDB 1.x write and query endpoints.  Writes are counted and thrown away
+    """
+
+    lines = 0
+    bytes = 0
+
+    def do_POST(self):
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlsplit(self.path)
+
+        if url.path == '/write':
+            InfluxDBHandler.bytes += len(body)
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            InfluxDBHandler.lines += body.count(b'\n') + 1
+            self._send(b'', status=204)
+        else:
+            self._send(b'{"results":[{"statement_id":0}]}')
+
+    do_GET = do_POST
+
+
+class _I8Marshaller(xmlrpc.client.Marshaller):
+    """
+    rTorrent sends integers as <i8> since sizes and byte counts don't fit in 32 bits.  The standard marshaller refuses
+    anything over 32 bits
+    """
+    dispatch = dict(xmlrpc.client.Marshaller.dispatch)
+
+    def dump_i8(self, value, write):
+        write('<value><i8>')
+        write(str(int(value)))
+        write('</i8></value>\n')
+
+    dispatch[int] = dump_i8
+
+
+class _RTorrentRequestHandler(SimpleXMLRPCRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0
+
+    def do_POST(self):
+        if self.latency:
+            time.sleep(self.latency)
+        super().do_POST()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RTorrentServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    rTorrent XMLRPC.  system.client_version, d.multicall2, t.multicall and system.multicall
+    """
+    daemon_threads = True
+
+    def __init__(self, address, torrents, latency=0):
+
+        handler = type('RTorrentRequestHandler', (_RTorrentRequestHandler,), {'latency': latency})
+        SimpleXMLRPCServer.__init__(self, address, requestHandler=handler, allow_none=True, logRequests=False)
+        self.torrents = torrents
+
+        self.register_multicall_functions()
+        self.register_function(lambda: '0.9.8', 'system.client_version')
+        self.register_function(self._d_multicall2, 'd.multicall2')
+        self.register_function(self._t_multicall, 't.multicall')
+
+    def _d_multicall2(self, target, view, *fields):
+
+        cycle = self.torrents.advance()
+        rows = []
+        for i in range(self.torrents.count):
+            torrent = self.torrents.torrent(i, cycle)
+            rows.append([torrent['hash'], torrent['name'], torrent['size'], torrent['downloaded'],
+                         torrent['uploaded'], int(torrent['ratio'] * 1000), int(torrent['state'] != 'Paused'),
+                         torrent['files'], torrent['seeds']])
+
+        return rows
+
+    def _t_multicall(self, hash, pattern, *fields):
+
+        tracker = self.torrents.torrent(int(hash, 16), 0)['tracker']
+        return [['http://{}:6969/announce'.format(tracker)], ['udp://backup.example.org:1337/announce']]
+
+
+def start_servers(count, latency=0, address='127.0.0.1'):
+    """
+    Start every fake server on its own thread
+    :param count: Number of torrents each client reports
+    :param latency: Seconds each torrent client request is delayed by
+    :param address: Address to listen on
+    :return: Dict of server name to port
+    """
+
+    ports = {}
+
+    for name, handler in (('deluge', DelugeHandler), ('utorrent', UTorrentHandler), ('influxdb', InfluxDBHandler)):
+        attrs = {'torrents': FakeTorrents(count), 'latency': 0 if name == 'influxdb' else latency}
+        server = ThreadingHTTPServer((address, 0), type(handler.__name__, (handler,), attrs))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ports[name] = server.server_address[1]
+
+    # Only ever done in the fake server's own process
+    xmlrpc.client.Marshaller = _I8Marshaller
+    server = RTorrentServer((address, 0), FakeTorrents(count), latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports['rtorrent'] = server.server_address[1]
+
+    return ports
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Fake torrent clients and InfluxDB for benchmarking')
+    parser.add_argument('--torrents', type=int, default=1000, help='Number of torrents each client reports')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds each torrent client request is delayed by')
+    args = parser.parse_args()
+
+    print(json.dumps(start_servers(args.torrents, latency=args.latency)), flush=True)
+
+    # Serve until the benchmark closes our stdin
+    sys.stdin.read()
+
+
+if __name__ == '__main__':
+    main()
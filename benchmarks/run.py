@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+"""
+Offline benchmark of the collection path.  Starts the fake servers in fakeservers.py, points a collector at them and
+times full polling cycles for each client at each torrent count.
+
+    python benchmarks/run.py --torrents 100,1000,10000,50000 --latency 0.005
+
+The first cycle is reported on its own since it includes the per torrent lookups that are cached afterwards
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from influxdbSeedbox import influxdbSeedbox
+
+CONFIG = """
+[GENERAL]
+Delay = 1
+Output = False
+Hostname = benchmark
+Rollups = {rollups}
+
+[INFLUXDB]
+Address = 127.0.0.1
+Port = {influxdb}
+Database = benchmark
+Gzip = {influx_gzip}
+Precision = {precision}
+
+[TORRENTCLIENT.deluge]
+Client = deluge
+Password = benchmark
+Url = http://127.0.0.1:{deluge}/json
+DelugeDiff = {deluge_diff}
+
+[TORRENTCLIENT.utorrent]
+Client = utorrent
+Username = benchmark
+Password = benchmark
+Url = http://127.0.0.1:{utorrent}/gui
+
+[TORRENTCLIENT.rtorrent]
+Client = rtorrent
+Url = http://127.0.0.1:{rtorrent}/RPC2
+
+[LOGGING]
+Enable = False
+Level = error
+LogFile = benchmark.log
+CensorLogs = True
+PrintThreshold = 2
+"""
+
+
+class FakeServers:
+    """
+    The fake servers running in their own process
+    """
+    def __init__(self, torrents, latency):
+
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'fakeservers.py'),
+                                         '--torrents', str(torrents), '--latency', str(latency)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.ports = json.loads(self.process.stdout.readline())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def run_cycles(collector, client_config, cycles):
+    """
+    Run polling cycles the same way the poll task does and write each one to the fake InfluxDB
+    :param collector: influxdbSeedbox
+    :param client_config: Dict of client settings from configManager
+    :param cycles: Number of cycles to run
+    :return: List of dicts, one per cycle
+    """
+
+    name = client_config['name']
+    tor_client = collector._create_client(client_config)
+    results = []
+
+    for _ in range(cycles):
+        start = time.perf_counter()
+        collector._collect(name, tor_client, time.time_ns())
+        points = collector.writer.queue.get_nowait()
+        collector.write_points(points)
+        elapsed = time.perf_counter() - start
+
+        stats = collector.client_stats[name]
+        results.append({
+            'cycle_time': stats['cycle_time'],
+            'total_time': elapsed,
+            'requests': stats['requests'],
+            'bytes_received': stats['bytes_received'],
+            'points': len(points),
+        })
+
+    return results
+
+
+def measure_memory(collector, client_config, cycles=2):
+    """
+    Run a new client for a couple of cycles with tracemalloc on.  Kept apart from the timed cycles since tracing
+    slows everything down
+    :return: Tuple of memory still held by the client and the peak during the cycles, in bytes
+    """
+
+    tracemalloc.start()
+    try:
+        tor_client = collector._create_client(client_config)
+        for _ in range(cycles):
+            collector._collect(client_config['name'], tor_client, time.time_ns())
+            collector.writer.queue.get_nowait()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return current, peak
+
+
+def benchmark(torrents, args):
+    """
+    Benchmark every requested client against one set of fake servers
+    :param torrents: Number of torrents
+    :param args: Parsed command line
+    :return: List of result dicts
+    """
+
+    servers = FakeServers(torrents, args.latency)
+    results = []
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config_file = os.path.join(directory, 'config.ini')
+            with open(config_file, 'w') as f:
+                f.write(CONFIG.format(rollups=args.rollups, deluge_diff=args.deluge_diff, influx_gzip=args.influx_gzip,
+                                      precision=args.precision, **servers.ports))
+
+            collector = influxdbSeedbox(config=config_file, silent=True)
+
+            for client_config in collector.config.tor_clients:
+                if client_config['client'] not in args.clients:
+                    continue
+
+                cycles = run_cycles(collector, client_config, args.cycles)
+                steady = cycles[1:] or cycles
+                result = {
+                    'client': client_config['client'],
+                    'torrents': torrents,
+                    'first_cycle': cycles[0]['cycle_time'],
+                    'cycle_time': sum(c['cycle_time'] for c in steady) / len(steady),
+                    'requests': sum(c['requests'] for c in steady) / len(steady),
+                    'first_requests': cycles[0]['requests'],
+                    'bytes_received': sum(c['bytes_received'] for c in steady) / len(steady),
+                    'points': steady[-1]['points'],
+                    'points_per_sec': sum(c['points'] for c in steady) / sum(c['total_time'] for c in steady),
+                }
+
+                if not args.no_memory:
+                    result['memory'], result['peak_memory'] = measure_memory(collector, client_config)
+
+                results.append(result)
+                print_result(result)
+    finally:
+        servers.close()
+
+    return results
+
+
+def print_result(result):
+
+    line = '{client:<10}{torrents:>9}{first_cycle:>12.3f}{cycle_time:>12.3f}{first_requests:>10}{requests:>10.0f}' \
+           '{kb:>12.0f}{points:>9}{points_per_sec:>12.0f}'.format(kb=result['bytes_received'] / 1024, **result)
+    if 'memory' in result:
+        line += '{:>11.1f}{:>11.1f}'.format(result['memory'] / 1024 ** 2, result['peak_memory'] / 1024 ** 2)
+    print(line, flush=True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the collector against fake torrent clients')
+    parser.add_argument('--clients', default='deluge,utorrent,rtorrent', help='Comma separated clients to benchmark')
+    parser.add_argument('--torrents', default='100,1000,10000', help='Comma separated torrent counts')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every torrent client request')
+    parser.add_argument('--cycles', type=int, default=5, help='Polling cycles to run for each client')
+    parser.add_argument('--rollups', default='tracker', help='Rollups to build each cycle')
+    parser.add_argument('--deluge-diff', action='store_true', help='Use Deluge diff requests')
+    parser.add_argument('--influx-gzip', action='store_true', help='Gzip writes to the fake InfluxDB')
+    parser.add_argument('--precision', default='ns', help='Timestamp precision to write')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the memory measurement')
+    parser.add_argument('--json', dest='json_file', help='Also write the results to this file as JSON')
+    args = parser.parse_args()
+    args.clients = [client.strip() for client in args.clients.split(',')]
+
+    header = '{:<10}{:>9}{:>12}{:>12}{:>10}{:>10}{:>12}{:>9}{:>12}'.format(
+        'client', 'torrents', 'first (s)', 'cycle (s)', 'first req', 'requests', 'recv (KB)', 'points', 'points/s')
+    if not args.no_memory:
+        header += '{:>11}{:>11}'.format('mem (MB)', 'peak (MB)')
+    print(header)
+
+    results = []
+    for torrents in args.torrents.split(','):
+        results.extend(benchmark(int(torrents), args))
+
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
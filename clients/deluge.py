@@ -1,21 +1,45 @@
-from urllib.request import Request, urlopen, URLError
+from urllib.request import Request
 import json
 import sys
-import gzip
 
-from clients.torrentclient import TorrentClient
+from clients.torrentclient import TorrentClient, AuthenticationFailed
+from clients.jsonstream import JSONStream
 
 
 class DelugeClient(TorrentClient):
 
-    def __init__(self, logger, username=None, password=None, url=None, hostname=None):
-        TorrentClient.__init__(self, logger, username=username, password=password, url=url, hostname=hostname)
+    # The WebUI drops sessions after an hour by default
+    auth_lifetime = 3600
+
+    # JSON-RPC error code Deluge answers with when the session isn't valid
+    AUTH_ERROR_CODE = 1
+
+    # Deluge status key to the TorrentRecord attribute it fills in.  Only these keys are requested, asking for ''
+    # returns every key Deluge has
+    STATUS_KEYS = {
+        'name': 'name',
+        'total_size': 'total_size',
+        'progress': 'progress',
+        'all_time_download': 'total_downloaded',
+        'total_uploaded': 'total_uploaded',
+        'ratio': 'ratio',
+        'total_seeds': 'total_seeds',
+        'state': 'state',
+        'tracker_host': 'tracker',
+        'num_files': 'total_files',
+    }
+
+    def __init__(self, logger, diff=False, **kwargs):
+        TorrentClient.__init__(self, logger, **kwargs)
 
-        self.session_id = None
         self.request_id = 0
         self.torrent_client = 'Deluge'
 
-        self._authenticate()
+        # With diff enabled Deluge only sends the keys that changed since the last call.  They're applied on top of
+        # the torrent records we already have
+        self.diff = diff
+
+        self._renew_auth()
 
     def _add_common_headers(self, req, headers=None):
         """
@@ -25,40 +49,14 @@ class DelugeClient(TorrentClient):
 
         self.send_log('Adding headers to request', 'debug')
 
+        # The session cookie is sent by the HTTP session
         headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
 
-        if self.session_id:
-            headers['Cookie'] = self.session_id
-
         return TorrentClient._add_common_headers(self, req, headers=headers)
 
-    def _check_session(self):
-        """
-        Make sure we still have an active session. If not, authenticate again
-        :return:
-        """
-
-        self.send_log('Checking Session State', 'debug')
-
-        req = self._create_request(method='auth.check_session', params=[''])
-
-        res = self._make_request(req, fail_msg='Failed To check session state.  HTTP Error')
-
-        if not res:
-            return
-
-        result = self._process_response(res)
-
-        if not result:
-            self.send_log('No active session. Attempting to re-authenticate', 'error')
-            self._authenticate()
-            return
-
-        self.send_log('Session is still active', 'debug')
-
     def _create_request(self, method=None, params=None):
         """
         Creates and returns a Request object, Allowing us to track request IDs in one spot.
@@ -72,7 +70,7 @@ class DelugeClient(TorrentClient):
             'params': params
         }).encode('utf-8')
 
-        self.send_log('Calling Deluge API with method {}'.format(method), 'debug')
+        self.send_log('Calling Deluge API with method {}', 'debug', method)
 
         req = self._add_common_headers(Request(self.url, data=data))
         self.request_id += 1
@@ -86,12 +84,8 @@ class DelugeClient(TorrentClient):
         :return:
         """
         # TODO Figure out exceptions here
-        if res.headers['Content-Encoding'] == 'gzip':
-            self.send_log('Detected gzipped response', 'debug')
-            raw_output = gzip.decompress(res.read()).decode('utf-8')
-        else:
-            self.send_log('Detected other type of response encoding: {}'.format(res.headers['Content-Encoding']), 'debug')
-            raw_output = res.read().decode('utf-8')
+        # Gzipped responses are decompressed by the HTTP session as they're read
+        raw_output = res.read().decode('utf-8')
 
         json_output = json.loads(raw_output)
 
@@ -103,50 +97,54 @@ class DelugeClient(TorrentClient):
         If we return from this method we assume we are authenticated for all future requests
         :return: None
         """
-        msg = 'Attempting to authenticate against {} API'.format(self.torrent_client)
-
         req = self._create_request(method='auth.login', params=[self.password])
 
-        res = self._make_request(req, genmsg=msg, fail_msg='Failed to contact API for authentication', abort_on_fail=True)
+        res = self._make_request(req, genmsg='Attempting to authenticate against {} API',
+                                 fail_msg='Failed to contact API for authentication', abort_on_fail=True,
+                                 log_args=(self.torrent_client,))
 
         output = self._process_response(res)
 
         # If response has result but it's None than the login failed
         if 'result' in output and not output['result']:
-            msg = 'Failed to authenticate to {} API. Check your password and try again.'.format(self.torrent_client)
-            self.send_log(msg, 'critical')
+            self.send_log('Failed to authenticate to {} API. Check your password and try again.', 'critical',
+                          self.torrent_client)
             sys.exit(1)
 
-        # We need the session ID to send with future requests
-        if 'Set-Cookie' in res.headers:
-            self.session_id = res.headers['Set-Cookie'].split(';')[0]
-        else:
+        # The HTTP session keeps the session cookie and sends it with future requests
+        if 'Set-Cookie' not in res.headers:
             self.send_log('No authentication cookie in response.  Aborting', 'critical')
             sys.exit(1)
 
-        msg = 'Successfully Authenticated With {} API'.format(self.torrent_client)
-        self.send_log(msg, 'info')
+        self.send_log('Successfully Authenticated With {} API', 'info', self.torrent_client)
 
     def _build_torrent_list(self, torrents):
         """
-        Take the resulting torrent list and create a consistent structure shared through all clients
-        :return:
+        Take the resulting torrent list and create a consistent structure shared through all clients.  Only the keys
+        present for each torrent are updated so this handles both full and diff responses
+        :param torrents: Iterable of (hash, status dict) pairs.  Read from the response as it's decoded so only one
+                         status is held at a time
+        :return: Set of every hash in the list
         """
-        msg = 'Structuring list of torrents'
-        self.send_log(msg, 'debug')
-
-        for hash, data in torrents.items():
-            self.torrent_list[hash] = {}
-            self.torrent_list[hash]['name'] = data['name']
-            self.torrent_list[hash]['total_size'] = data['total_size']
-            self.torrent_list[hash]['progress'] = round(data['progress'], 2)
-            self.torrent_list[hash]['total_downloaded'] = data['all_time_download']
-            self.torrent_list[hash]['total_uploaded'] = data['total_uploaded']
-            self.torrent_list[hash]['ratio'] = data['ratio']
-            self.torrent_list[hash]['total_seeds'] = data['total_seeds']
-            self.torrent_list[hash]['state'] = data['state']
-            self.torrent_list[hash]['tracker'] = data['tracker_host']
-            self.torrent_list[hash]['total_files'] = data['num_files']
+        self.send_log('Structuring list of torrents', 'debug')
+
+        hashes = set()
+        changed = 0
+
+        for hash, data in torrents:
+            hashes.add(hash)
+            if data:
+                changed += 1
+
+            record = self.torrent_list.record(hash)
+            for key, value in data.items():
+                if key == 'progress':
+                    value = round(value, 2)
+                setattr(record, self.STATUS_KEYS[key], value)
+
+        self.send_log('Updated {} of {} torrents', 'debug', changed, len(hashes))
+
+        return hashes
 
     def get_all_torrents(self):
         """
@@ -156,43 +154,76 @@ class DelugeClient(TorrentClient):
 
         self.send_log('Getting list of torrents', 'debug')
 
-        req = self._create_request(method='core.get_torrents_status', params=['',''])
+        # Sent with the session we have.  Only if Deluge rejects it do we log in again
+        hashes = self._with_auth(self._get_torrents_status, self.diff)
 
-        self._check_session() # Make sure we still have an active session
+        if hashes is None:
+            self.torrent_list.clear()
+            return
 
-        res = self._make_request(req, fail_msg='Failed to get list of torrents from API')
+        self._prune_torrents(hashes)
 
-        if not res:
-            self.torrent_list = {}
-            return
+    def _get_torrents_status(self, diff=False):
+        """
+        Request the status of every torrent.  The response is decoded as it's read and each status goes straight into
+        the torrent list
+        :param diff: Ask Deluge to only send keys that changed since the last diff request
+        :return: Set of every hash in the client or None on failure
+        """
 
-        output = self._process_response(res)
+        params = [{}, list(self.STATUS_KEYS)]
+        if diff:
+            params.append(True)
 
-        if not output:
-            return
+        req = self._create_request(method='core.get_torrents_status', params=params)
 
-        if output['error']:
-            msg = 'Problem getting torrent list from {}. Error: {}'.format(self.torrent_client, output['error'])
-            self.send_log(msg, 'error')
-            self.torrent_list = {}
-            return
+        with self.stats.phase('list'):
+            res = self._make_request(req, fail_msg='Failed to get list of torrents from API')
+            if not res:
+                return None
+
+            stream = JSONStream(res)
+            skipped = []
+            with res:
+                hashes = self._build_torrent_list(self._iter_status(stream, diff, skipped))
+
+        error = stream.fields.get('error')
+        if isinstance(error, dict) and error.get('code') == self.AUTH_ERROR_CODE:
+            raise AuthenticationFailed(error.get('message'))
+
+        if error:
+            self.send_log('Problem getting torrent list from {}. Error: {}', 'error', self.torrent_client, error)
+            return None
 
-        self._build_torrent_list(output['result'])
+        # The result was null instead of an object of statuses
+        if 'result' in stream.fields:
+            return None
 
-        # Temp trap to find weird characters that won't decode
+        if skipped:
+            self.send_log('Torrent status diff is out of sync.  Requesting full status', 'info')
+            return self._get_torrents_status(diff=False)
+
+        return hashes
+
+    def _iter_status(self, stream, diff, skipped):
         """
-        for k, v in output['result'].items():
-            print(k)
-            print(v.keys())
-            for k2, v2 in v.items():
-                try:
-                    print('Key: ' + k2)
-                    print('Value: ' + str(v2))
-                except Exception as e:
-                    print('test')
-                    print(e)
+        Yield each torrent's status from the response as it's decoded.
+
+        Deluge includes every torrent in a diff but only with the keys that changed.  If we get a partial status for a
+        torrent we don't know about Deluge's diff state is ahead of ours (e.g. we restarted).  Those are left out and
+        added to skipped so a full request can be made
+        :param stream: JSONStream of the response
+        :param diff: The response is a diff
+        :param skipped: List the hashes of out of sync torrents are added to
+        :return: Generator of (hash, status dict)
         """
 
+        for _, (hash, status) in stream.stream_members(('result',)):
+            if diff and hash not in self.torrent_list and len(status) < len(self.STATUS_KEYS):
+                skipped.append(hash)
+                continue
+            yield hash, status
+
     def get_active_plugins(self):
         """
         Return all active plugins
@@ -200,22 +231,15 @@ class DelugeClient(TorrentClient):
         """
 
         req = self._create_request(method='core.get_enabled_plugins', params=[])
-        try:
-            self._check_session() # Make sure we still have an active session
-            res = urlopen(req)
-        except URLError as e:
-            msg = 'Failed to get list of plugins.  HTTP Error'
-            self.send_log(msg, 'error')
-            print(msg)
-            print(e)
+        res = self._make_request(req, fail_msg='Failed to get list of plugins.  HTTP Error')
+        if not res:
             self.active_plugins = []
             return
 
         output = self._process_response(res)
         if output['error']:
-            msg = 'Problem getting plugin list from {}. Error: {}'.format(self.torrent_client, output['error'])
-            print(msg)
-            self.send_log(msg, 'error')
+            self.send_log('Problem getting plugin list from {}. Error: {}', 'error', self.torrent_client,
+                          output['error'])
             self.active_plugins = []
             return
 
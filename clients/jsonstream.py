@@ -0,0 +1,170 @@
+import codecs
+import json
+
+"""
+Incremental JSON decoding for large API responses.  The response is read in chunks and decoded a value at a time, so
+a torrent list can be processed one torrent at a time instead of holding the raw body, the decoded text and the full
+parsed document in memory at once
+"""
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_END = (',', ']', '}', ' ', '\t', '\n', '\r')
+
+
+class JSONStream:
+    """
+    Reads a JSON document from a file like object.  The top level object is walked by hand and only the members asked
+    for are streamed.  Everything else is decoded whole into fields
+    """
+    def __init__(self, fp, chunk_size=65536):
+        """
+        :param fp: File like object with read(amt) returning bytes
+        :param chunk_size: Bytes to read at a time
+        """
+
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.fields = {}
+        self.streamed = set()
+
+    def _fill(self):
+        """
+        Read another chunk onto the end of the buffer, dropping what has already been consumed
+        :return: False if there was nothing left to read
+        """
+
+        if self.eof:
+            return False
+
+        data = self.fp.read(self.chunk_size)
+        if data:
+            text = self.decoder.decode(data)
+        else:
+            self.eof = True
+            text = self.decoder.decode(b'', final=True)
+
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+        return True
+
+    def _peek(self):
+        """
+        :return: The next non whitespace character without consuming it.  Empty string at the end of the document
+        """
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        """
+        Consume the next character, which must be one of chars
+        :param chars: String of allowed characters
+        :return: The character
+        """
+
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError('Expected one of {!r} in JSON response, got {!r}'.format(chars, char or 'end of data'))
+        self.pos += 1
+
+        return char
+
+    def value(self):
+        """
+        Decode the next complete value
+        :return: Decoded value
+        """
+
+        self._peek()
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+
+            # A number cut off by the end of the buffer can still decode (1 from 1.5, 1 from 1e5) so it only counts
+            # once something that ends a number follows it
+            if isinstance(value, (int, float)) and self.buffer[end:end + 1] not in _NUMBER_END and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def members(self):
+        """
+        Walk the object at the current position.  Yields each member name with the stream positioned at its value,
+        which has to be consumed before asking for the next name
+        :return: Generator of member names
+        """
+
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            name = self.value()
+            self._expect(':')
+            yield name
+            if self._expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Walk the array at the current position.  Yields once per element with the stream positioned at it
+        :return: Generator of None
+        """
+
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield
+            if self._expect(',]') == ']':
+                return
+
+    def stream_members(self, keys):
+        """
+        Walk the top level object, streaming the members named in keys.  For an object member each (name, value)
+        pair is yielded, for an array member each element.  The keys that were streamed are added to streamed.  Other
+        members, and streamed keys whose value isn't an object or array (e.g. null), are decoded into fields
+        :param keys: Iterable of member names to stream
+        :return: Generator of (key, item) tuples
+        """
+
+        for key in self.members():
+            container = self._peek()
+
+            if key not in keys or container not in ('{', '['):
+                self.fields[key] = self.value()
+                continue
+
+            self.streamed.add(key)
+            if container == '{':
+                for name in self.members():
+                    yield key, (name, self.value())
+            else:
+                for _ in self.elements():
+                    yield key, self.value()
+
+        if self._peek():
+            raise ValueError('Unexpected data after the JSON response')
@@ -0,0 +1,172 @@
+"""
+Group-by rollups over the torrent store.  The store is turned into a columnar view once per cycle and every rollup is
+a single pass over it.  NumPy is used when it's installed, otherwise it falls back to plain Python
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Rollup name to the measurement it's written to and the columns it's grouped by
+ROLLUPS = {
+    'tracker': ('trackers', ('tracker',)),
+    'state': ('states', ('state',)),
+    'tracker_state': ('tracker_states', ('tracker', 'state')),
+    'host': ('host_totals', ()),
+}
+
+# Ratio percentiles included in every rollup
+PERCENTILES = (50, 90)
+
+
+class ColumnarView:
+    """
+    The torrent store as one list per value.  With NumPy the numeric columns are also converted to arrays once so
+    every rollup can share them
+    """
+    def __init__(self, store):
+
+        self.tracker = []
+        self.state = []
+        self.uploaded = []
+        self.downloaded = []
+        self.size = []
+        self.ratio = []
+        self.upload_rate = []
+        self.download_rate = []
+
+        for data in store.values():
+            self.tracker.append(data.tracker)
+            self.state.append(str(data.state))
+            self.uploaded.append(data.total_uploaded or 0)
+            self.downloaded.append(data.total_downloaded or 0)
+            self.size.append(data.total_size or 0)
+            self.ratio.append(float(data.ratio or 0))
+            self.upload_rate.append(data.upload_rate)
+            self.download_rate.append(data.download_rate)
+
+        self.arrays = None
+        if numpy is not None:
+            self.arrays = {
+                'uploaded': numpy.array(self.uploaded, dtype=numpy.int64),
+                'downloaded': numpy.array(self.downloaded, dtype=numpy.int64),
+                'size': numpy.array(self.size, dtype=numpy.int64),
+                'ratio': numpy.array(self.ratio, dtype=numpy.float64),
+                'has_rate': numpy.array([rate is not None for rate in self.upload_rate], dtype=numpy.int64),
+                'upload_rate': numpy.array([rate or 0 for rate in self.upload_rate], dtype=numpy.int64),
+                'download_rate': numpy.array([rate or 0 for rate in self.download_rate], dtype=numpy.int64),
+            }
+
+    def __len__(self):
+        return len(self.tracker)
+
+
+def _percentile_index(count, percentile):
+    # The lower of the two nearest ranks, the same as NumPy's 'lower' method.  Both code paths use this so they agree
+    return int((count - 1) * percentile / 100)
+
+
+def _aggregate_python(view, keys):
+
+    groups = {}
+
+    for i in range(len(view)):
+        key = keys[i]
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                'total_torrents': 0,
+                'total_uploaded': 0,
+                'total_downloaded': 0,
+                'total_size': 0,
+                'total_ratio': 0.0,
+                'upload_rate': None,
+                'download_rate': None,
+                'ratios': [],
+            }
+
+        group['total_torrents'] += 1
+        group['total_uploaded'] += view.uploaded[i]
+        group['total_downloaded'] += view.downloaded[i]
+        group['total_size'] += view.size[i]
+        group['total_ratio'] += view.ratio[i]
+        group['ratios'].append(view.ratio[i])
+
+        if view.upload_rate[i] is not None:
+            group['upload_rate'] = (group['upload_rate'] or 0) + view.upload_rate[i]
+            group['download_rate'] = (group['download_rate'] or 0) + view.download_rate[i]
+
+    for group in groups.values():
+        ratios = sorted(group.pop('ratios'))
+        for percentile in PERCENTILES:
+            group['ratio_p{}'.format(percentile)] = ratios[_percentile_index(len(ratios), percentile)]
+
+    return groups
+
+
+def _aggregate_numpy(view, keys):
+
+    # Number the groups in Python, a dict lookup per row is much cheaper than having NumPy sort Python objects
+    index = {}
+    codes = numpy.array([index.setdefault(key, len(index)) for key in keys], dtype=numpy.int64)
+    arrays = view.arrays
+
+    # Sort by group then ratio so each group is a contiguous run with its ratios in order.  Every sum is then a
+    # single reduceat over the runs, which keeps the integer totals exact
+    order = numpy.lexsort((arrays['ratio'], codes))
+    torrents = numpy.bincount(codes, minlength=len(index))
+    starts = numpy.cumsum(torrents) - torrents
+
+    def group_sum(column):
+        return numpy.add.reduceat(arrays[column][order], starts)
+
+    uploaded = group_sum('uploaded')
+    downloaded = group_sum('downloaded')
+    size = group_sum('size')
+    total_ratio = group_sum('ratio')
+    rated = group_sum('has_rate')
+    upload_rate = group_sum('upload_rate')
+    download_rate = group_sum('download_rate')
+    sorted_ratio = arrays['ratio'][order]
+
+    groups = {}
+    for key, i in index.items():
+        group = {
+            'total_torrents': int(torrents[i]),
+            'total_uploaded': int(uploaded[i]),
+            'total_downloaded': int(downloaded[i]),
+            'total_size': int(size[i]),
+            'total_ratio': float(total_ratio[i]),
+            'upload_rate': int(upload_rate[i]) if rated[i] else None,
+            'download_rate': int(download_rate[i]) if rated[i] else None,
+        }
+        for percentile in PERCENTILES:
+            group['ratio_p{}'.format(percentile)] = float(sorted_ratio[starts[i] + _percentile_index(int(torrents[i]),
+                                                                                                     percentile)])
+        groups[key] = group
+
+    return groups
+
+
+def aggregate(view, columns):
+    """
+    Group the view by the given columns and total up each group
+    :param view: ColumnarView
+    :param columns: Tuple of column names to group by.  Empty puts everything in one group
+    :return: Dict of group key (tuple of column values) to dict of totals
+    """
+
+    if not len(view):
+        return {}
+
+    if columns:
+        keys = list(zip(*[getattr(view, column) for column in columns]))
+    else:
+        keys = [()] * len(view)
+
+    if view.arrays is not None:
+        return _aggregate_numpy(view, keys)
+
+    return _aggregate_python(view, keys)
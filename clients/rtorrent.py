@@ -1,29 +1,105 @@
-from rtorrent import RTorrent
 from clients.torrentclient import TorrentClient
 import sys
+import xmlrpc.client
 from urllib.parse import urlsplit
 
 
+class _CountingResponse:
+    """
+    Wraps the HTTP response handed to the XMLRPC parser so the bytes it reads are counted
+    """
+    def __init__(self, response, stats):
+        self.response = response
+        self.stats = stats
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.stats.count_bytes(len(data))
+        return data
+
+    def close(self):
+        self.response.close()
+
+
+class _TimeoutMixin:
+    """
+    Apply the client timeout to the connection the transport keeps open between calls, and count requests and bytes
+    against the client's stats
+    """
+    def __init__(self, timeout=None, stats=None, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.stats = stats
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+    def send_request(self, host, handler, request_body, debug):
+        if self.stats:
+            self.stats.count_request()
+        return super().send_request(host, handler, request_body, debug)
+
+    def parse_response(self, response):
+        if self.stats:
+            response = _CountingResponse(response, self.stats)
+        return super().parse_response(response)
+
+
+class TimeoutTransport(_TimeoutMixin, xmlrpc.client.Transport):
+    pass
+
+
+class TimeoutSafeTransport(_TimeoutMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
 class rTorrentClient(TorrentClient):
 
-    def __init__(self, logger, username=None, password=None, url=None, hostname=None):
+    # Every field we need from each torrent, fetched for all torrents in a single d.multicall2
+    TORRENT_FIELDS = [
+        'd.hash=',
+        'd.name=',
+        'd.size_bytes=',
+        'd.completed_bytes=',
+        'd.up.total=',
+        'd.ratio=',
+        'd.state=',
+        'd.size_files=',
+        'd.peers_complete=',
+    ]
+
+    # Max number of t.multicall calls bundled into one system.multicall
+    TRACKER_BATCH_SIZE = 500
 
-        TorrentClient.__init__(self, logger, username=username, password=password, url=url, hostname=hostname)
+    def __init__(self, logger, **kwargs):
+
+        TorrentClient.__init__(self, logger, **kwargs)
         self.torrent_client = 'rTorrent'
-        self._authenticate()
         self.rtorrent = None
 
-        self._authenticate()
+        self._renew_auth()
 
     def _authenticate(self):
         """
-        Setup connection to rTorrent XMLRPC server
+        Setup connection to rTorrent XMLRPC server.  The same connection is reused for every call after this
         :return:
         """
 
+        if urlsplit(self.url).scheme == 'https':
+            transport = TimeoutSafeTransport(timeout=self.timeout, stats=self.stats)
+        else:
+            transport = TimeoutTransport(timeout=self.timeout, stats=self.stats)
+
+        self.rtorrent = xmlrpc.client.ServerProxy(self.url, transport=transport)
+
         try:
-            self.rtorrent = RTorrent(self.url)
-        except ConnectionRefusedError as e:
+            self.rtorrent.system.client_version()
+        except (OSError, xmlrpc.client.Error) as e:
             self.send_log('Failed to connect to rTorrent.  Aborting', 'critical')
             sys.exit(1)
 
@@ -32,28 +108,67 @@ class rTorrentClient(TorrentClient):
     def _build_torrent_list(self, torrents):
         """
         Take the resulting torrent list and create a consistent structure shared through all clients
+        :param torrents: Rows from d.multicall2 in the order of TORRENT_FIELDS
         :return:
         """
         self.send_log('Structuring list of torrents', 'debug')
 
-        for torrent in torrents:
-            self.torrent_list[torrent.info_hash] = {}
-            self.torrent_list[torrent.info_hash]['name'] = torrent.name
-            self.torrent_list[torrent.info_hash]['total_size'] = torrent.size_bytes
-            self.torrent_list[torrent.info_hash]['progress'] = round((torrent.bytes_done / torrent.size_bytes * 100), 2)
-            self.torrent_list[torrent.info_hash]['total_downloaded'] = torrent.bytes_done
-            self.torrent_list[torrent.info_hash]['total_uploaded'] = 1 # TODO Need to figure out where to get this
-            self.torrent_list[torrent.info_hash]['ratio'] = torrent.ratio
-            self.torrent_list[torrent.info_hash]['total_seeds'] = 'N/A'
-            self.torrent_list[torrent.info_hash]['state'] = torrent.get_state()
-            self.torrent_list[torrent.info_hash]['tracker'] = urlsplit(torrent.get_trackers()[0].url).netloc
-            self.torrent_list[torrent.info_hash]['total_files'] = torrent.size_files
+        # The tracker needs an extra call per torrent so it's cached after the first lookup
+        metadata = self._get_cached_metadata([torrent[0] for torrent in torrents], self._get_trackers, batch=True)
+
+        for hash, name, size_bytes, completed_bytes, up_total, ratio, state, size_files, seeds in torrents:
+            torrent_metadata = metadata[hash] or {'tracker': 'N/A'}
+            record = self.torrent_list.record(hash)
+            record.name = name
+            record.total_size = size_bytes
+            record.progress = round(completed_bytes / size_bytes * 100, 2) if size_bytes else 0.0
+            record.total_downloaded = completed_bytes
+            record.total_uploaded = up_total
+            record.ratio = ratio / 1000
+            record.total_seeds = seeds
+            record.state = state
+            record.tracker = torrent_metadata['tracker']
+            record.total_files = size_files
+
+    def _get_trackers(self, hashes):
+        """
+        Get the tracker for each torrent.  The t.multicall for each torrent is bundled into batched system.multicall
+        requests
+        :param hashes: List of hashes to look up
+        :return: Dict of hash to dict with the tracker
+        """
+
+        results = {}
+
+        for i in range(0, len(hashes), self.TRACKER_BATCH_SIZE):
+            batch = hashes[i:i + self.TRACKER_BATCH_SIZE]
+            calls = [{'methodName': 't.multicall', 'params': [hash, '', 't.url=']} for hash in batch]
 
+            for hash, result in zip(batch, self.rtorrent.system.multicall(calls)):
+                # Successful calls come back wrapped in a single element list.  Failures are a fault dict
+                if isinstance(result, dict) or not result[0]:
+                    results[hash] = None
+                    continue
+                results[hash] = {'tracker': urlsplit(result[0][0][0]).netloc}
+
+        return results
 
     def get_all_torrents(self):
         """
         Return list of all torrents
         :return:
         """
-        self._authenticate() # We need to get another Rtorrent object so we get a fresh list of torrents
-        self._build_torrent_list(self.rtorrent.torrents)
+
+        self.send_log('Getting list of torrents', 'debug')
+
+        try:
+            with self.stats.phase('list'):
+                torrents = self.rtorrent.d.multicall2('', 'main', *self.TORRENT_FIELDS)
+        except (OSError, xmlrpc.client.Error) as e:
+            self.stats.count_error()
+            self.send_log('Failed to get list of torrents from rTorrent: {}', 'error', e)
+            self.torrent_list.clear()
+            return
+
+        self._build_torrent_list(torrents)
+        self._prune_torrents([torrent[0] for torrent in torrents])
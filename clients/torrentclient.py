@@ -1,6 +1,21 @@
 __author__ = 'barry'
-from urllib.request import urlopen, URLError
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit, urljoin
+from urllib.request import Request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+from contextlib import contextmanager
+import http.client
+import threading
+import base64
+import zlib
+import io
 import sys
+import time
+
+from lineprotocol import make_line
+from clients.torrentstore import TorrentStore
+from clients.rollups import ROLLUPS, ColumnarView, aggregate
 
 # TODO Deal with slashes in client URL
 
@@ -8,15 +23,472 @@ import sys
 Base class for torrent clients
 """
 
+
+class AuthenticationFailed(Exception):
+    """
+    The client rejected our session or token.  Raised by requests so the caller can authenticate again and retry
+    """
+
+class ClientStats:
+    """
+    Timings and counters for a client's current polling cycle.  Phase timings are the wall time spent in each part of
+    the cycle.  Requests and lookups can run on the worker threads so the counters are updated under a lock
+    """
+
+    phases = ['auth', 'list', 'lookup', 'build', 'rollup']
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        # Kept across cycles
+        self.overruns = 0
+        self.interval = 0.0
+        self.reset()
+
+    def reset(self):
+        """
+        Clear everything ready for a new cycle
+        :return: None
+        """
+
+        with self.lock:
+            self.timings = dict.fromkeys(self.phases, 0.0)
+            self.requests = 0
+            self.bytes_received = 0
+            self.errors = 0
+            self.torrents = 0
+            self.points = 0
+            self.cycle_time = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a block of code and add it to the phase
+        :param name: One of phases
+        :return: None
+        """
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.timings[name] += elapsed
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def count_bytes(self, count):
+        with self.lock:
+            self.bytes_received += count
+
+    def count_error(self, count=1):
+        with self.lock:
+            self.errors += count
+
+    def as_dict(self):
+        """
+        :return: Dict of field name to value for the cycle
+        """
+
+        with self.lock:
+            stats = {'{}_time'.format(name): round(elapsed, 4) for name, elapsed in self.timings.items()}
+            stats.update({
+                'bytes_received': self.bytes_received,
+                'cycle_time': round(self.cycle_time, 4),
+                'errors': self.errors,
+                'interval': round(float(self.interval), 2),
+                'overruns': self.overruns,
+                'points': self.points,
+                'requests': self.requests,
+                'torrents': self.torrents,
+            })
+
+        return stats
+
+
+class SessionResponse:
+    """
+    File like response returned by HTTPSession.  Gzipped bodies are decompressed as they are read.  Once the body
+    has been fully read the connection goes back to the session's pool to be reused
+    """
+    def __init__(self, session, key, conn, response):
+
+        self.session = session
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.closed = False
+
+        if response.headers.get('Content-Encoding', '').lower() == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, amt=-1):
+        """
+        Read up to amt bytes of the (decompressed) body.  Reads the whole body if amt is not given
+        :param amt:
+        :return: bytes
+        """
+
+        if self.closed:
+            return b''
+
+        if amt is None or amt < 0:
+            data = self.response.read()
+            self._count(data)
+            if self.decompressor:
+                data = self.decompressor.decompress(self.decompressor.unconsumed_tail + data)
+                data += self.decompressor.flush()
+            self.close()
+            return data
+
+        while True:
+            if not self.decompressor:
+                data = self.response.read(amt)
+                self._count(data)
+                if not data:
+                    self.close()
+                return data
+
+            raw = self.decompressor.unconsumed_tail
+            if not raw:
+                raw = self.response.read(amt)
+                self._count(raw)
+            if not raw:
+                data = self.decompressor.flush()
+                self.close()
+                return data
+
+            # The gzip header doesn't produce any output so keep reading until we have something to return
+            data = self.decompressor.decompress(raw, amt)
+            if data:
+                return data
+
+    def _count(self, data):
+        # Bytes as received, before they're decompressed
+        if self.session.stats and data:
+            self.session.stats.count_bytes(len(data))
+
+    def close(self):
+        """
+        Release the connection.  It's only reused if the whole body was read and the server is keeping it open
+        :return: None
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.response.isclosed() and not self.response.will_close:
+            self.session.release(self.key, self.conn)
+        else:
+            self.response.close()
+            self.conn.close()
+
+
+class HTTPSession:
+    """
+    Shared HTTP layer for the torrent clients.  Keeps a pool of keep-alive connections per host so we aren't opening
+    a new connection (and TLS handshake) for every API call, and handles cookies, basic auth and gzip in one place.
+
+    Takes the same Request objects urlopen does and raises the same URLError/HTTPError exceptions.  Redirects on the
+    same host are followed like urlopen follows them
+    """
+
+    redirect_codes = (301, 302, 303, 307, 308)
+    max_redirects = 5
+
+    def __init__(self, timeout=30, connect_timeout=10, gzip=True, pool_size=8, stats=None):
+
+        self.timeout = timeout  # Read timeout
+        self.connect_timeout = connect_timeout
+        self.gzip = gzip
+        self.pool_size = pool_size
+        self.auth_header = None
+        self.cookies = {}
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.stats = stats  # ClientStats to count requests and bytes against
+
+    def set_basic_auth(self, username, password):
+        """
+        Send basic auth credentials with every request
+        :param username:
+        :param password:
+        :return: None
+        """
+
+        credentials = '{}:{}'.format(username, password).encode('utf-8')
+        self.auth_header = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+    def clear_cookies(self):
+        with self.lock:
+            self.cookies = {}
+
+    def _acquire(self, key):
+        """
+        Get an idle connection for the host or create a new one
+        :param key: Tuple of scheme, host and port
+        :return: Tuple of connection and whether it's been used before
+        """
+
+        with self.lock:
+            idle = self.pools.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+
+        return conn, False
+
+    def release(self, key, conn):
+        """
+        Return a connection to the pool.  If the pool is already full the connection is closed
+        :param key: Tuple of scheme, host and port
+        :param conn:
+        :return: None
+        """
+
+        with self.lock:
+            idle = self.pools.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def _store_cookies(self, response):
+
+        cookies = response.headers.get_all('Set-Cookie') or []
+        with self.lock:
+            for cookie in cookies:
+                name, _, value = cookie.split(';')[0].partition('=')
+                self.cookies[name.strip()] = value.strip()
+
+    def _build_headers(self, req):
+
+        headers = dict(req.header_items())
+
+        if self.gzip:
+            headers.setdefault('Accept-Encoding', 'gzip')
+
+        if self.auth_header:
+            headers.setdefault('Authorization', self.auth_header)
+
+        with self.lock:
+            if self.cookies:
+                headers.setdefault('Cookie', '; '.join('{}={}'.format(k, v) for k, v in self.cookies.items()))
+
+        return headers
+
+    def open(self, req):
+        """
+        Make the request using a pooled connection, following any redirects
+        :param req: urllib Request object
+        :return: SessionResponse
+        """
+
+        res = self._send(req)
+        redirects = 0
+
+        while res.status in self.redirect_codes:
+            location = res.headers.get('Location')
+            # Read the rest of the redirect so the connection can be reused
+            res.read()
+
+            if not location or redirects >= self.max_redirects:
+                raise HTTPError(req.full_url, res.status, res.reason, res.headers, io.BytesIO(b''))
+
+            req = self._redirect_request(req, res.status, urljoin(req.full_url, location))
+            res = self._send(req)
+            redirects += 1
+
+        if res.status >= 400:
+            body = res.read()
+            raise HTTPError(req.full_url, res.status, res.reason, res.headers, io.BytesIO(body))
+
+        return res
+
+    def _redirect_request(self, req, status, url):
+        """
+        Build the request to send to a redirect's Location.  301, 302 and 303 turn a POST into a GET the way urlopen
+        does, 307 and 308 resend it as is.  Cookies and basic auth are sent with every request so redirects to another
+        host aren't followed
+        :param req: Request that was redirected
+        :param status: Redirect status
+        :param url: Absolute URL to go to
+        :return: Request
+        """
+
+        if urlsplit(url).hostname != urlsplit(req.full_url).hostname:
+            raise HTTPError(req.full_url, status, 'Redirect to another host not followed: {}'.format(url), None,
+                            io.BytesIO(b''))
+
+        headers = dict(req.header_items())
+        if status in (307, 308) or req.get_method() in ('GET', 'HEAD'):
+            return Request(url, data=req.data, headers=headers, method=req.get_method())
+
+        headers = {k: v for k, v in headers.items() if k.lower() not in ('content-type', 'content-length')}
+        return Request(url, headers=headers)
+
+    def _send(self, req):
+        """
+        Send a single request on a pooled connection
+        :param req: urllib Request object
+        :return: SessionResponse
+        """
+
+        url = urlsplit(req.full_url)
+        key = (url.scheme, url.hostname, url.port)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        headers = self._build_headers(req)
+        if self.stats:
+            self.stats.count_request()
+
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                if not conn.sock:
+                    conn.connect()
+                    conn.sock.settimeout(self.timeout)
+                conn.request(req.get_method(), path, body=req.data, headers=headers)
+                response = conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine) as e:
+                conn.close()
+                # The server may have dropped an idle connection.  Try again with a fresh one
+                if reused:
+                    continue
+                raise URLError(e)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise URLError(e)
+            break
+
+        self._store_cookies(response)
+
+        return SessionResponse(self, key, conn, response)
+
+
+class MetadataCache:
+    """
+    Holds per torrent data that doesn't change once a torrent is added (tracker, file count) so it only has to be
+    requested from the client the first time a hash is seen
+    """
+    def __init__(self, ttl=0, max_size=0):
+
+        self.ttl = ttl  # Seconds an entry is kept.  0 keeps it until the torrent is removed
+        self.max_size = max_size  # Max number of hashes held.  0 is unlimited
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, hash):
+        """
+        Return the cached metadata for a hash
+        :param hash:
+        :return: Dict of metadata or None if it's not cached or has expired
+        """
+
+        entry = self.entries.get(hash)
+        if not entry:
+            return None
+
+        cached_at, metadata = entry
+        if self.ttl and time.monotonic() - cached_at > self.ttl:
+            del self.entries[hash]
+            return None
+
+        return metadata
+
+    def set(self, hash, metadata):
+        """
+        Cache metadata for a hash.  If the cache is full the oldest entries are dropped
+        :param hash:
+        :param metadata: Dict of metadata
+        :return: None
+        """
+
+        self.entries[hash] = (time.monotonic(), metadata)
+        self.entries.move_to_end(hash)
+
+        if self.max_size:
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict_missing(self, hashes):
+        """
+        Drop any hash the client is no longer reporting
+        :param hashes: Collection of hashes currently in the client
+        :return: None
+        """
+
+        for hash in [h for h in self.entries if h not in hashes]:
+            del self.entries[hash]
+
+    def discard(self, hash):
+        """
+        Drop a single hash from the cache if it's there
+        :param hash:
+        :return: None
+        """
+
+        self.entries.pop(hash, None)
+
+
 class TorrentClient:
     """
     Stub class to base individual torrent client classes on
     """
-    def __init__(self, logger, username=None, password=None, url=None, hostname=None):
+
+    # Seconds a session or token is trusted before authenticating again ahead of time.  0 keeps it until the client
+    # rejects it
+    auth_lifetime = 0
+
+    # HTTP statuses the client answers with when our session or token is no longer valid
+    auth_failure_codes = ()
+
+    # Seconds to wait before authenticating again when the client keeps rejecting us.  Doubles with each rejection in
+    # a row.  The first rejection is usually just an expired session so that one is retried straight away.  Polls in
+    # the wait fail without contacting the client
+    auth_retry_delay = 1
+    max_auth_retry_delay = 60
+
+    def __init__(self, logger, username=None, password=None, url=None, hostname=None, workers=8, timeout=30,
+                 connect_timeout=10, gzip=True, cache_ttl=0, cache_size=0, delta=False, heartbeat=300,
+                 rollups=('tracker',), idle_interval=0, auth_lifetime=None):
 
         self.send_log = logger
         self.hostname = hostname
 
+        # Request Handling
+        self.workers = workers if workers and workers > 0 else 1
+        self.timeout = timeout
+        self.pool = None
+        self.stats = ClientStats()
+        self.session = HTTPSession(timeout=timeout, connect_timeout=connect_timeout, gzip=gzip,
+                                   pool_size=self.workers, stats=self.stats)
+
         # TODO Validate we're not getting None
 
         # API Data
@@ -24,11 +496,34 @@ class TorrentClient:
         self.password = password
         self.url = url
 
+        # Authentication
+        # Requests go out with the cached session or token and we only authenticate again once it's expired or the
+        # client rejects it
+        if auth_lifetime is not None:
+            self.auth_lifetime = auth_lifetime
+        self.auth_expires = None
+        self.auth_rejections = 0
+        self.auth_retry_at = 0
+
         # Torrent Data
         self.torrent_client = None
-        self.torrent_list = {}
+        self.torrent_list = TorrentStore()
         self.trackers = []
         self.active_plugins = []
+        self.metadata = MetadataCache(ttl=cache_ttl, max_size=cache_size)
+        self.rollups = rollups or ()
+
+        # Delta Mode
+        # Only torrents that changed since they were last written are sent.  Every heartbeat seconds everything is
+        # written so dashboards still have recent data for idle torrents
+        self.delta = delta
+        self.heartbeat = heartbeat
+        self.last_heartbeat = None
+
+        # Polling Tiers
+        # Active torrents are written every poll.  Idle ones are only written every idle_interval seconds.  0 writes
+        # everything every poll
+        self.idle_interval = idle_interval
 
     def _add_common_headers(self, req, headers=None):
         """
@@ -56,21 +551,27 @@ class TorrentClient:
         """
         raise NotImplementedError
 
-    def _make_request(self, req, genmsg='', fail_msg='', abort_on_fail=None):
+    def _make_request(self, req, genmsg='', fail_msg='', abort_on_fail=None, log_args=()):
         """
         Make the web request.  Doing it here avoids a lot of duplicate exception handling
         :param gen_msg: Message we can print to console or logs so we know about the request
         :param fail_msg: Message we can print to console or logs on failure
         :param abort_on_fail: Exit on failed request
+        :param log_args: Values formatted into genmsg and fail_msg, only if they're logged
         :return: Response
         """
 
         if genmsg:
-            self.send_log(genmsg, 'info')
+            self.send_log(genmsg, 'info', *log_args)
 
         try:
-            res = urlopen(req)
-        except URLError as e:
+            res = self.session.open(req)
+        except OSError as e:  # URLError, timeouts and dropped connections
+            self.stats.count_error()
+
+            # Login requests abort below instead
+            if isinstance(e, HTTPError) and e.code in self.auth_failure_codes and not abort_on_fail:
+                raise AuthenticationFailed('HTTP {}'.format(e.code))
 
             if fail_msg:
                 msg = fail_msg
@@ -78,16 +579,115 @@ class TorrentClient:
                 msg = 'Failed to make request'
 
             if abort_on_fail:
-                self.send_log(msg, 'critical')
+                self.send_log(msg, 'critical', *log_args)
                 self.send_log('Aborting', 'critical')
                 sys.exit(1)
             else:
-                self.send_log(msg, 'error')
+                self.send_log(msg, 'error', *log_args)
 
             return None
 
         return res
 
+    def _run_concurrent(self, func, items):
+        """
+        Run func against every item using the client's worker pool.  Used for the per torrent lookups some clients
+        need so a cycle takes as long as the slowest batch of requests instead of the sum of all of them.
+
+        A failure for one item is logged and counted, it doesn't stop the rest from being processed
+        :param func: Callable taking a single item
+        :param items: Iterable of items to process
+        :return: Dict of item to result.  Failed items have a result of None
+        """
+
+        if not self.pool:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        results = {}
+        failed = 0
+
+        futures = {self.pool.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except Exception as e:
+                failed += 1
+                self.send_log('Lookup failed for {}: {}', 'debug', item, e)
+                results[item] = None
+
+        if failed:
+            self.stats.count_error(failed)
+            self.send_log('{} of {} lookups failed', 'warning', failed, len(futures))
+
+        return results
+
+    def _get_cached_metadata(self, hashes, lookup, batch=False):
+        """
+        Return the metadata for every hash, only calling lookup for hashes that aren't already cached.
+
+        Lookups that come back with an 'N/A' value aren't cached so they get retried next cycle
+        :param hashes: List of hashes currently in the client
+        :param lookup: Callable taking a hash and returning a dict of metadata.  Run through the worker pool
+        :param batch: lookup takes the list of uncached hashes and returns a dict of hash to metadata dict instead
+        :return: Dict of hash to metadata dict.  Failed lookups are None
+        """
+
+        results = {}
+        missing = []
+        for hash in hashes:
+            metadata = self.metadata.get(hash)
+            if metadata:
+                results[hash] = metadata
+            else:
+                missing.append(hash)
+
+        if not missing:
+            return results
+
+        self.send_log('Looking up metadata for {} new torrents', 'debug', len(missing))
+
+        with self.stats.phase('lookup'):
+            if batch:
+                try:
+                    fetched = lookup(missing)
+                except Exception as e:
+                    self.stats.count_error()
+                    self.send_log('Metadata lookup failed: {}', 'error', e)
+                    fetched = {}
+            else:
+                fetched = self._run_concurrent(lookup, missing)
+
+        for hash in missing:
+            metadata = fetched.get(hash)
+            if metadata and 'N/A' not in metadata.values():
+                self.metadata.set(hash, metadata)
+            results[hash] = metadata
+
+        return results
+
+    def _remove_torrents(self, hashes):
+        """
+        Drop torrents that have been removed from the client
+        :param hashes: Iterable of removed hashes
+        :return: None
+        """
+
+        for hash in hashes:
+            self.torrent_list.remove(hash)
+            self.metadata.discard(hash)
+
+    def _prune_torrents(self, hashes):
+        """
+        Given the full list of hashes in the client, drop anything we're holding on to for torrents not in it
+        :param hashes: Collection of every hash currently in the client
+        :return: None
+        """
+
+        hashes = set(hashes)
+        self._remove_torrents(self.torrent_list.missing(hashes))
+        self.metadata.evict_missing(hashes)
+
     def _process_response(self, res):
         """
         Perform response handling for the specific torrent client.  Each line requires different processing/decoding of
@@ -104,6 +704,86 @@ class TorrentClient:
         """
         raise NotImplementedError
 
+    def _renew_auth(self):
+        """
+        Authenticate and start the lifetime of the new session or token.  A failed login is backed off the same as a
+        rejected session so a changed password isn't retried every poll
+        :return: None
+        """
+
+        try:
+            with self.stats.phase('auth'):
+                self._authenticate()
+        except SystemExit:
+            # Clients exit when the login itself fails
+            self.auth_expires = None
+            self._delay_auth('could not log in')
+            raise
+
+        self.auth_expires = time.monotonic() + self.auth_lifetime if self.auth_lifetime else float('inf')
+
+    def _with_auth(self, func, *args):
+        """
+        Call func with the cached session or token, authenticating first only if it has expired.  The first time the
+        client rejects it we authenticate again and retry straight away.  If it keeps rejecting us the poll fails and
+        we wait before authenticating again, doubling the wait each time so a client with a problem isn't flooded with
+        logins.  The wait is checked on later polls rather than slept through so the poll cadence isn't held up
+        :param func: Callable that makes the requests.  Raises AuthenticationFailed if the client rejects them
+        :param args: Passed to func
+        :return: Result of func
+        """
+
+        now = time.monotonic()
+        if self.auth_expires is None or now >= self.auth_expires:
+            if now < self.auth_retry_at:
+                raise AuthenticationFailed('Waiting {:.0f} more seconds before authenticating again'.format(
+                    self.auth_retry_at - now))
+
+            self.send_log('{} session has expired.  Authenticating again', 'debug', self.torrent_client)
+            self._renew_auth()
+            # Only a session that has been working is worth retrying straight away
+            retry = False
+        else:
+            retry = True
+
+        try:
+            result = func(*args)
+        except AuthenticationFailed as e:
+            self.auth_expires = None
+
+            if not retry or self.auth_rejections:
+                self._delay_auth(e)
+                raise
+
+            self.send_log('{} rejected our session ({}).  Authenticating again', 'info', self.torrent_client, e)
+            self.session.clear_cookies()
+            self._renew_auth()
+
+            try:
+                result = func(*args)
+            except AuthenticationFailed as e:
+                self.auth_expires = None
+                self._delay_auth(e)
+                raise
+
+        self.auth_rejections = 0
+
+        return result
+
+    def _delay_auth(self, error):
+        """
+        Hold off authenticating again after a rejection or a failed login.  The wait doubles with each one in a row
+        :param error: AuthenticationFailed from the client, or why the login failed
+        :return: None
+        """
+
+        self.auth_rejections += 1
+        delay = min(self.auth_retry_delay * 2 ** (self.auth_rejections - 1), self.max_auth_retry_delay)
+        self.auth_retry_at = time.monotonic() + delay
+
+        self.send_log('{} authentication failed ({}).  Not authenticating again for {} seconds', 'warning',
+                      self.torrent_client, error, delay)
+
     def _build_torrent_list(self, torrents):
         """
         Take the raw list of torrents from the API and build a unified structure shared by all clients
@@ -128,99 +808,201 @@ class TorrentClient:
         # TODO probably only needed in Deluge.
         raise NotImplementedError
 
-    def process_tracker_list(self):
+    def _update_rate(self, hash, data, now):
         """
-        Go through the list of torrents and build the list of trackers
-        :return: list of JSON objects for each tracker
+        Work out the upload and download rate of a torrent from its previous sample.  If a counter went backwards
+        (torrent re-added, client reset its stats) there's no rate for that cycle and the new value becomes the
+        baseline
+        :param hash:
+        :param data: TorrentRecord.  The rates are stored on it
+        :param now: Time of the sample in seconds
+        :return: None
+        """
+
+        uploaded = data.total_uploaded
+        downloaded = data.total_downloaded
+        prev_time = data.sample_time
+        prev_uploaded = data.sample_uploaded
+        prev_downloaded = data.sample_downloaded
+
+        data.sample_time = now
+        data.sample_uploaded = uploaded
+        data.sample_downloaded = downloaded
+
+        if prev_time is None or not isinstance(uploaded, int) or not isinstance(downloaded, int):
+            data.upload_rate = data.download_rate = None
+            return
+
+        elapsed = now - prev_time
+
+        if elapsed <= 0:
+            return
+
+        if uploaded < prev_uploaded or downloaded < prev_downloaded:
+            self.send_log('Counter reset for hash {}', 'debug', hash)
+            data.upload_rate = data.download_rate = None
+            return
+
+        data.upload_rate = int((uploaded - prev_uploaded) / elapsed)
+        data.download_rate = int((downloaded - prev_downloaded) / elapsed)
+
+    def process_rollups(self, timestamp=None):
+        """
+        Build every configured rollup from the torrent list.  Rollup rates are the sum of the torrent rates worked out
+        in process_torrents so that needs to run first in the cycle
+        :param timestamp: Time of the points in nanoseconds.  InfluxDB uses the time it receives them if not given
+        :return: list of line protocol strings, one for each group of each rollup
         """
         if len(self.torrent_list) == 0:
             return None
 
-        trackers = {}
-        json_list = []
+        # Summing the torrent rates instead of diffing the group totals means a removed torrent doesn't look like a
+        # counter reset
+        view = ColumnarView(self.torrent_list)
+        lines = []
 
-        # The tracker list is a dict of torrent hashes.  The value for each hash is another dict with data about the
-        # torrent
-        for hash, data in self.torrent_list.items():
-            if data['tracker'] in trackers:
-                trackers[data['tracker']]['total_torrents'] += 1
-                trackers[data['tracker']]['total_uploaded'] += data['total_uploaded']
-                trackers[data['tracker']]['total_downloaded'] += data['total_downloaded']
-                trackers[data['tracker']]['total_size'] += data['total_size']
-                trackers[data['tracker']]['total_ratio'] += data['ratio']
-            else:
-                trackers[data['tracker']] = {}
-                trackers[data['tracker']]['total_torrents'] = 1
-                trackers[data['tracker']]['total_uploaded'] = data['total_uploaded']
-                trackers[data['tracker']]['total_downloaded'] = data['total_downloaded']
-                trackers[data['tracker']]['total_size'] = data['total_size']
-                trackers[data['tracker']]['total_ratio'] = data['ratio']
-
-        for k, v in trackers.items():
-
-            tracker_json = [
-                {
-                    'measurement': 'trackers',
-                    'fields': {
-                        'total_torrents': v['total_torrents'],
-                        'total_upload': v['total_uploaded'],
-                        'total_download': v['total_downloaded'],
-                        'total_ratio': v['total_ratio'],
-                        'tracker': k,
-                    },
-                    'tags': {
-                        'host': self.hostname,
-                        'tracker': k,
-                        'client': self.torrent_client
-                    }
-                }
+        for rollup in self.rollups:
+            lines.extend(self._rollup_lines(view, rollup, timestamp))
+
+        return lines
+
+    def _rollup_lines(self, view, rollup, timestamp):
+        """
+        Aggregate the view for one rollup and format each group as line protocol
+        :param view: ColumnarView of the torrent list
+        :param rollup: Name of the rollup in ROLLUPS
+        :param timestamp: Time of the points in nanoseconds
+        :return: list of line protocol strings
+        """
+
+        measurement, columns = ROLLUPS[rollup]
+        lines = []
+
+        for key, v in aggregate(view, columns).items():
+
+            tags = [('client', self.torrent_client), ('host', self.hostname)]
+            tags.extend(zip(columns, key))
+            tags.sort()
+
+            fields = [
+                ('avg_ratio', v['total_ratio'] / v['total_torrents']),
+                ('download_rate', v['download_rate']),
+                ('ratio_p50', v['ratio_p50']),
+                ('ratio_p90', v['ratio_p90']),
+                ('total_download', v['total_downloaded']),
+                ('total_ratio', v['total_ratio']),
+                ('total_size', v['total_size']),
+                ('total_torrents', v['total_torrents']),
+                ('total_upload', v['total_uploaded']),
+                ('upload_rate', v['upload_rate']),
             ]
 
-            json_list.append(tracker_json)
+            # Kept as a field as well as a tag for dashboards built before it was a tag
+            if rollup == 'tracker':
+                fields.insert(9, ('tracker', key[0]))
+
+            lines.append(make_line(measurement, tags, fields, timestamp))
 
-        return json_list
+        return lines
 
-    def process_torrents(self):
+    def process_torrents(self, timestamp=None):
         """
-        Go through the list of torrents, format them in JSON and send to influx
-        :return:
+        Go through the list of torrents and format them as line protocol to send to influx.  In delta mode torrents
+        that haven't changed since they were last written are skipped unless the heartbeat is due.  Idle torrents are
+        skipped until their idle interval is up
+        :param timestamp: Time of the points in nanoseconds.  InfluxDB uses the time it receives them if not given
+        :return: list of line protocol strings, one for each torrent
         """
         if len(self.torrent_list) == 0:
             return None
 
-        json_list = []
+        lines = []
+        now = timestamp / 1e9 if timestamp else time.time()
+
+        # The delta mode heartbeat writes everything, idle torrents included
+        heartbeat_due = False
+        if self.delta:
+            if self.last_heartbeat is None or (self.heartbeat and now - self.last_heartbeat >= self.heartbeat):
+                self.last_heartbeat = now
+                heartbeat_due = True
 
         for hash, data in self.torrent_list.items():
 
-            torrent_json = [
-                {
-                    'measurement': 'torrents',
-                    'fields': {
-                        'hash': hash,
-                        'tracker': data['tracker'],
-                        'name': data['name'],
-                        'state': data['state'],
-                        'uploaded': data['total_uploaded'],
-                        'downloaded': data['total_downloaded'],
-                        'ratio': round(data['ratio'], 2),
-                        'progress': round(data['progress'], 2),
-                        'seeds': data['total_seeds'],
-                        'size': data['total_size'],
-                        'total_files': data['total_files'],
-                    },
-                    'tags': {
-
-                        'host': self.hostname,
-                        'hash': hash,
-                        'tracker': data['tracker'],
-                        'client': self.torrent_client
-
-                    }
-                }
+            self._update_rate(hash, data, now)
+
+            if not heartbeat_due and not self._emit_due(data, now):
+                continue
+
+            tags = [
+                ('client', self.torrent_client),
+                ('hash', hash),
+                ('host', self.hostname),
+                ('tracker', data.tracker),
+            ]
+            fields = [
+                ('download_rate', data.download_rate),
+                ('downloaded', data.total_downloaded),
+                ('hash', hash),
+                ('name', data.name),
+                ('progress', round(data.progress, 2)),
+                ('ratio', round(data.ratio, 2)),
+                ('seeds', data.total_seeds),
+                ('size', data.total_size),
+                ('state', data.state),
+                ('total_files', data.total_files),
+                ('tracker', data.tracker),
+                ('upload_rate', data.upload_rate),
+                ('uploaded', data.total_uploaded),
             ]
 
-            json_list.append(torrent_json)
+            # Compare the line without the timestamp to what was last written for the torrent
+            line = make_line('torrents', tags, fields)
+            if self.delta:
+                if not heartbeat_due and data.last_line == line:
+                    continue
+                data.last_line = line
+
+            if timestamp:
+                line += ' ' + str(timestamp)
+
+            data.last_emit = now
+            data.emit_state = data.state
+            data.emit_active = self._is_active(data)
+            lines.append(line)
+
+        return lines
+
+    def _is_active(self, data):
+        """
+        Decide which tier a torrent is in for this cycle.  A torrent is active while it's transferring or its client
+        reports it as downloading
+        :param data: TorrentRecord
+        :return: bool
+        """
+
+        if data.upload_rate or data.download_rate:
+            return True
+
+        # Deluge and uTorrent both report Downloading.  rTorrent only reports started/stopped so it relies on rates
+        return 'download' in str(data.state).lower()
+
+    def _emit_due(self, data, now):
+        """
+        Check if a torrent should be written this cycle under the polling tiers
+        :param data: TorrentRecord
+        :param now: Time of the cycle in seconds
+        :return: bool
+        """
+
+        if not self.idle_interval or data.last_emit is None:
+            return True
 
-        return json_list
+        # A change of state is written straight away so pausing or finishing a torrent isn't held back
+        if data.state != data.emit_state or self._is_active(data):
+            return True
 
+        # Going idle is written once so the last point doesn't leave a transfer rate showing until the next idle write
+        if data.emit_active:
+            return True
 
+        return now - data.last_emit >= self.idle_interval
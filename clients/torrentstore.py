@@ -0,0 +1,126 @@
+"""
+Compact store for the unified torrent data every client fills in.  Each torrent is a slotted record instead of a dict
+with string keys, and the store drops torrents the client no longer reports
+"""
+
+class TorrentRecord:
+    """
+    Everything we track for a single torrent.  The first block is the unified data filled in by each client, the
+    rest is state kept between polling cycles
+    """
+    __slots__ = (
+        'name',
+        'total_size',
+        'progress',
+        'total_downloaded',
+        'total_uploaded',
+        'ratio',
+        'total_seeds',
+        'state',
+        'tracker',
+        'total_files',
+
+        # Line last written in delta mode, without the timestamp
+        'last_line',
+
+        # When the torrent was last written, its state at the time and whether it was active, used for the idle tier
+        'last_emit',
+        'emit_state',
+        'emit_active',
+
+        # Previous sample used to work out rates
+        'sample_time',
+        'sample_uploaded',
+        'sample_downloaded',
+        'upload_rate',
+        'download_rate',
+    )
+
+    def __init__(self):
+
+        self.name = None
+        self.total_size = 0
+        self.progress = 0
+        self.total_downloaded = 0
+        self.total_uploaded = 0
+        self.ratio = 0
+        self.total_seeds = None
+        self.state = None
+        self.tracker = 'N/A'
+        self.total_files = None
+
+        self.last_line = None
+
+        self.last_emit = None
+        self.emit_state = None
+        self.emit_active = False
+
+        self.sample_time = None
+        self.sample_uploaded = None
+        self.sample_downloaded = None
+        self.upload_rate = None
+        self.download_rate = None
+
+
+class TorrentStore:
+    """
+    Torrent records keyed by hash.  Clients update records in place each cycle rather than rebuilding the list
+    """
+    def __init__(self):
+
+        self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, hash):
+        return hash in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, hash):
+        return self.records[hash]
+
+    def items(self):
+        return self.records.items()
+
+    def values(self):
+        return self.records.values()
+
+    def get(self, hash):
+        return self.records.get(hash)
+
+    def record(self, hash):
+        """
+        Get the record for a hash, creating it the first time the hash is seen
+        :param hash:
+        :return: TorrentRecord
+        """
+
+        record = self.records.get(hash)
+        if record is None:
+            record = self.records[hash] = TorrentRecord()
+
+        return record
+
+    def remove(self, hash):
+        """
+        Drop a torrent from the store if it's there
+        :param hash:
+        :return: None
+        """
+
+        self.records.pop(hash, None)
+
+    def missing(self, hashes):
+        """
+        Find the torrents in the store that aren't in the given collection
+        :param hashes: Collection of every hash currently in the client
+        :return: List of hashes
+        """
+
+        return [hash for hash in self.records if hash not in hashes]
+
+    def clear(self):
+        self.records.clear()
@@ -1,41 +1,44 @@
-import urllib.request
-from urllib.request import Request, urlopen, URLError
+from urllib.request import Request
 from urllib.parse import urlsplit
 from bs4 import BeautifulSoup
 import json
 import re
 from clients.torrentclient import TorrentClient
+from clients.jsonstream import JSONStream
 
 class UTorrentClient(TorrentClient):
 
-    def __init__(self, logger, username=None, password=None, url=None, hostname=None):
-        TorrentClient.__init__(self, logger, username=username, password=password, url=url, hostname=hostname)
+    # Tokens expire after 30 minutes.  Get a new one a little before that
+    auth_lifetime = 1500
+
+    # An expired token gets a 400, and a GUID cookie the WebUI no longer knows a 401
+    auth_failure_codes = (400, 401)
+
+    def __init__(self, logger, **kwargs):
+        TorrentClient.__init__(self, logger, **kwargs)
 
         self.token = None
-        self.cookie = None
+        self.cache_id = None  # WebUI cid.  Lets us request only the torrents that changed since the last list
         self.torrent_client = 'uTorrent'
 
-        self._authenticate()
+        self._renew_auth()
 
     def _authenticate(self):
+        """
+        Get the token required by the WebUI API.  Basic auth and the GUID cookie that goes with the token are sent by
+        the HTTP session on every request
+        :return: None
+        """
 
-        # TODO Clean this whole mess up.  It's barely functional
-        pwd_mgr = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-        pwd_mgr.add_password(None, self.url, self.username, self.password)
-        handler = urllib.request.HTTPBasicAuthHandler(pwd_mgr)
-        opener = urllib.request.build_opener(handler)
+        self.session.set_basic_auth(self.username, self.password)
         token_url = self.url + '/token.html'
 
-        self.send_log('Attempting To Get Token From URL {}'.format(token_url), 'info')
-
-        opener.open(token_url)
-        urllib.request.install_opener(opener)
-        req = Request(self.url + '/token.html')
-        res = urlopen(req)
-        self.cookie = res.headers['Set-Cookie'].split(';')[0]
+        res = self._make_request(Request(token_url), genmsg='Attempting To Get Token From URL {}',
+                                 fail_msg='Failed to get token from uTorrent', abort_on_fail=True,
+                                 log_args=(token_url,))
         soup = BeautifulSoup(res, 'html.parser')
         token = soup.find("div", {"id": "token"}).text
-        self.send_log('Got Token: {}'.format(token), 'info')
+        self.send_log('Got Token: {}', 'info', token)
         self.token = token
 
     def _add_common_headers(self, req, headers=None):
@@ -46,8 +49,7 @@ class UTorrentClient(TorrentClient):
         """
 
         headers = {
-            'cache-control': 'no-cache',
-            'Cookie': self.cookie
+            'cache-control': 'no-cache'
         }
 
         return TorrentClient._add_common_headers(self, req, headers=headers)
@@ -55,8 +57,7 @@ class UTorrentClient(TorrentClient):
     def _create_request(self, method=None, params=None):
         # TODO Validate that we get params
         url = self.url + '/?token={}&{}'.format(self.token, params)
-        msg = 'Creating request with url: {}'.format(url)
-        self.send_log(msg, 'debug')
+        self.send_log('Creating request with url: {}', 'debug', url)
 
         req = self._add_common_headers(Request(url))
 
@@ -65,24 +66,69 @@ class UTorrentClient(TorrentClient):
     def _build_torrent_list(self, torrents):
         """
         Take the resulting torrent list and create a consistent structure shared through all clients
-        :return:
+        :param torrents: Iterable of torrent rows.  Read from the response as it's decoded so only one row is held at
+                         a time
+        :return: Tuple of every hash in the list and the hashes that still need their metadata looked up
         """
 
         self.send_log('Structuring list of torrents', 'debug')
 
+        hashes = []
+        missing = []
+
         for torrent in torrents:
-            self.torrent_list[torrent[0]] = {}
-            self.torrent_list[torrent[0]]['name'] = torrent[2]
-            self.torrent_list[torrent[0]]['total_size'] = torrent[3]
-            self.torrent_list[torrent[0]]['progress'] = torrent[4] / 1000 * 100
-            self.torrent_list[torrent[0]]['total_downloaded'] = torrent[5]
-            self.torrent_list[torrent[0]]['total_uploaded'] = torrent[6]
-            self.torrent_list[torrent[0]]['ratio'] = torrent[7] / 1000
-            self.torrent_list[torrent[0]]['total_seeds'] = torrent[15]
-            self.torrent_list[torrent[0]]['state'] = torrent[22]
-            self.torrent_list[torrent[0]]['tracker'] = self._get_tracker(torrent[0])
-            self.torrent_list[torrent[0]]['total_files'] = self._get_file_count(torrent[0])
+            hash = torrent[0]
+            hashes.append(hash)
+
+            record = self.torrent_list.record(hash)
+            record.name = torrent[2]
+            record.total_size = torrent[3]
+            record.progress = torrent[4] / 1000 * 100
+            record.total_downloaded = torrent[5]
+            record.total_uploaded = torrent[6]
+            record.ratio = torrent[7] / 1000
+            record.total_seeds = torrent[15]
+            record.state = torrent[22]
+
+            metadata = self.metadata.get(hash)
+            if metadata:
+                record.tracker = metadata['tracker']
+                record.total_files = metadata['total_files']
+            else:
+                missing.append(hash)
+
+        return hashes, missing
+
+    def _update_metadata(self, hashes):
+        """
+        Fill in the tracker and file count for torrents that aren't in the metadata cache.  They each need their own
+        API call per torrent so they're cached after the first lookup and run through the worker pool
+        :param hashes: Hashes of torrents without cached metadata
+        :return: None
+        """
+
+        if not hashes:
+            return
 
+        metadata = self._get_cached_metadata(hashes, self._get_metadata)
+
+        for hash in hashes:
+            torrent_metadata = metadata[hash] or {'tracker': 'N/A', 'total_files': 'N/A'}
+            record = self.torrent_list.record(hash)
+            record.tracker = torrent_metadata['tracker']
+            record.total_files = torrent_metadata['total_files']
+
+    def _get_metadata(self, hash):
+        """
+        Get the tracker and file count for a torrent.  Runs in the worker pool
+        :param hash:
+        :return: Dict with the tracker and file count
+        """
+
+        return {
+            'tracker': self._get_tracker(hash),
+            'total_files': self._get_file_count(hash)
+        }
 
     def _get_tracker(self, hash):
         """
@@ -91,13 +137,11 @@ class UTorrentClient(TorrentClient):
         :return:
         """
 
-        msg = 'Attempting to get tracker for hash {}'.format(hash)
-        self.send_log(msg, 'debug')
+        self.send_log('Attempting to get tracker for hash {}', 'debug', hash)
 
         req = self._create_request(params='action=getprops&hash={}'.format(hash))
 
-        fail_msg = msg = 'Failed to get trackers from URL for hash {}'.format(hash)
-        res = self._make_request(req, fail_msg=fail_msg)
+        res = self._make_request(req, fail_msg='Failed to get trackers from URL for hash {}', log_args=(hash,))
 
         if not res:
             return 'N/A'
@@ -129,12 +173,11 @@ class UTorrentClient(TorrentClient):
         :return:
         """
 
-        msg = 'Attempting to get file list for hash {}'.format(hash)
-        self.send_log(msg, 'debug')
+        self.send_log('Attempting to get file list for hash {}', 'debug', hash)
 
         req = self._create_request(params='action=getfiles&hash={}'.format(hash))
 
-        res = self._make_request(req, fail_msg='Failed to get file list for hash '.format(hash))
+        res = self._make_request(req, fail_msg='Failed to get file list for hash {}', log_args=(hash,))
 
         if not res:
             return 'N/A'
@@ -148,24 +191,58 @@ class UTorrentClient(TorrentClient):
 
     def get_all_torrents(self):
         """
-        Get all torrents that are currently active
+        Get all torrents that are currently active.
+
+        After the first full list we pass the cache ID uTorrent gave us back with each request so it only returns
+        the torrents that changed (torrentp) and the ones that were removed (torrentm).  If uTorrent doesn't
+        recognize the cache ID (restart, cache expired) it sends the full list again
         :return:
         """
 
-        msg = 'Attempting to get all torrents from {}'.format(self.url)
-        self.send_log(msg, 'debug')
+        self.send_log('Attempting to get all torrents from {}', 'debug', self.url)
 
-        req = self._create_request(params='list=1')
+        # Sent with the token we have.  A new token is only fetched once it's expired or uTorrent rejects it
+        self._with_auth(self._get_torrent_list)
 
-        res = self._make_request(req, fail_msg='Failed to get list of all torrents')
+    def _get_torrent_list(self):
+        """
+        Request the torrent list and apply it to the torrent records
+        :return: None
+        """
 
-        if not res:
-            self.torrent_list = {}
+        if self.cache_id:
+            req = self._create_request(params='list=1&cid={}'.format(self.cache_id))
+        else:
+            req = self._create_request(params='list=1')
+
+        with self.stats.phase('list'):
+            res = self._make_request(req, fail_msg='Failed to get list of all torrents')
+
+            if not res:
+                self.cache_id = None
+                self.torrent_list.clear()
+                return
+
+            # A full list comes back in torrents and a list of changes in torrentp.  The rows go into the torrent list
+            # as they're decoded
+            stream = JSONStream(res)
+            rows = (row for _, row in stream.stream_members(('torrents', 'torrentp')))
+            with res:
+                hashes, missing = self._build_torrent_list(rows)
+
+        self._update_metadata(missing)
+        output = stream.fields
+
+        if 'torrents' in stream.streamed:
+            self.send_log('Received full torrent list', 'debug')
+            self._prune_torrents(hashes)
+        elif 'torrentp' in stream.streamed and self.cache_id:
+            self.send_log('Received {} changed and {} removed torrents', 'debug', len(hashes),
+                          len(output.get('torrentm', [])))
+            self._remove_torrents(output.get('torrentm', []))
+        else:
+            self.cache_id = None
+            self.torrent_list.clear()
             return
 
-        output = self._process_response(res)
-
-        if 'torrents' in output:
-            self._build_torrent_list(output['torrents'])
-        else:
-            self.torrent_list = {}
+        self.cache_id = output.get('torrentc')
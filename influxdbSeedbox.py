@@ -6,9 +6,16 @@ import time
 import logging
 import re
 import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from writer import QueuedWriter
+from spool import Spool
+from scheduler import PollScheduler, AdaptiveInterval
+from statsserver import StatsServer
+from lineprotocol import make_line, PRECISIONS
+from clients.rollups import ROLLUPS
+from sinks.sink import WriteRejected
 
 
 # TODO Move urlopen login in each method call to one central method
@@ -23,6 +30,7 @@ class configManager():
     def __init__(self, silent, config):
 
         self.valid_torrent_clients = ['deluge', 'utorrent', 'rtorrent']
+        self.valid_sinks = ['influxdb', 'influxdb2', 'udp', 'file', 'prometheus']
         self.valid_log_levels = {
             'DEBUG': 0,
             'INFO': 1,
@@ -46,6 +54,12 @@ class configManager():
         self._load_config_values()
         self._validate_logging_level()
         self._validate_torrent_client()
+        self._validate_sinks()
+        self._validate_queue_overflow()
+        self._validate_spool()
+        self._validate_rollups()
+        self._validate_overrun_policy()
+        self._validate_delay()
         if not self.silent:
             print('Configuration Successfully Loaded')
 
@@ -57,16 +71,54 @@ class configManager():
         self.hostname = self.config['GENERAL'].get('Hostname')
         if not self.hostname:
             self.hostname = socket.gethostname()
+        self.delta_mode = self.config['GENERAL'].getboolean('DeltaMode', fallback=False)
+        self.heartbeat = self.config['GENERAL'].getint('Heartbeat', fallback=300)
+        self.overrun_policy = self.config['GENERAL'].get('OverrunPolicy', fallback='skip').lower()
+        self.jitter = self.config['GENERAL'].getfloat('Jitter', fallback=0)
+        self.adaptive_delay = self.config['GENERAL'].getboolean('AdaptiveDelay', fallback=False)
+        self.max_delay = self.config['GENERAL'].getint('MaxDelay', fallback=60)
+        self.idle_interval = self.config['GENERAL'].getint('IdleInterval', fallback=0)
+        self.stats_address = self.config['GENERAL'].get('StatsAddress', fallback='127.0.0.1')
+        self.stats_port = self.config['GENERAL'].getint('StatsPort', fallback=0)
+        self.rollups = self._parse_list(self.config['GENERAL'].get('Rollups', fallback='tracker'))
+        self.sinks = self._parse_list(self.config['GENERAL'].get('Sinks', fallback='influxdb'))
 
 
         # InfluxDB
-        self.influx_address = self.config['INFLUXDB']['Address']
+        self.influx_address = self.config['INFLUXDB'].get('Address', fallback='')
         self.influx_port = self.config['INFLUXDB'].getint('Port', fallback=8086)
         self.influx_database = self.config['INFLUXDB'].get('Database', fallback='speedtests')
         self.influx_user = self.config['INFLUXDB'].get('Username', fallback='')
         self.influx_password = self.config['INFLUXDB'].get('Password', fallback='')
         self.influx_ssl = self.config['INFLUXDB'].getboolean('SSL', fallback=False)
         self.influx_verify_ssl = self.config['INFLUXDB'].getboolean('Verify_SSL', fallback=True)
+        self.influx_gzip = self.config['INFLUXDB'].getboolean('Gzip', fallback=False)
+        self.influx_precision = self.config['INFLUXDB'].get('Precision', fallback='ns').lower()
+        self.influx_batch_size = self.config['INFLUXDB'].getint('BatchSize', fallback=5000)
+        self.influx_queue_size = self.config['INFLUXDB'].getint('QueueSize', fallback=100)
+        self.influx_queue_overflow = self.config['INFLUXDB'].get('QueueOverflow', fallback='drop_oldest').lower()
+        self.influx_spool_dir = self.config['INFLUXDB'].get('SpoolDir', fallback='')
+        self.influx_spool_segment_size = self.config['INFLUXDB'].getint('SpoolSegmentSize', fallback=16)
+        self.influx_spool_max_size = self.config['INFLUXDB'].getint('SpoolMaxSize', fallback=1024)
+        self.influx_spool_replay_rate = self.config['INFLUXDB'].getint('SpoolReplayRate', fallback=5000)
+
+        # Other sinks.  Their sections are only needed when the sink is used
+        self.influx2_url = self.config.get('INFLUXDB2', 'Url', fallback='')
+        self.influx2_org = self.config.get('INFLUXDB2', 'Org', fallback='')
+        self.influx2_bucket = self.config.get('INFLUXDB2', 'Bucket', fallback='seedbox')
+        self.influx2_token = self.config.get('INFLUXDB2', 'Token', fallback='')
+        self.influx2_verify_ssl = self.config.getboolean('INFLUXDB2', 'Verify_SSL', fallback=True)
+        self.influx2_gzip = self.config.getboolean('INFLUXDB2', 'Gzip', fallback=False)
+        self.influx2_precision = self.config.get('INFLUXDB2', 'Precision', fallback='ns').lower()
+        self.udp_address = self.config.get('UDP', 'Address', fallback='')
+        self.udp_port = self.config.getint('UDP', 'Port', fallback=8089)
+        self.udp_packet_size = self.config.getint('UDP', 'PacketSize', fallback=1400)
+        self.file_directory = self.config.get('FILE', 'Directory', fallback='')
+        self.file_max_size = self.config.getint('FILE', 'MaxSize', fallback=100)
+        self.file_backups = self.config.getint('FILE', 'Backups', fallback=5)
+        self.prometheus_address = self.config.get('PROMETHEUS', 'Address', fallback='127.0.0.1')
+        self.prometheus_port = self.config.getint('PROMETHEUS', 'Port', fallback=9166)
+        self.prometheus_stale_after = self.config.getint('PROMETHEUS', 'StaleAfter', fallback=600)
 
         #Logging
         self.logging = self.config['LOGGING'].getboolean('Enable', fallback=False)
@@ -74,19 +126,148 @@ class configManager():
         self.logging_file = self.config['LOGGING']['LogFile']
         self.logging_censor = self.config['LOGGING'].getboolean('CensorLogs', fallback=True)
         self.logging_print_threshold = self.config['LOGGING'].getint('PrintThreshold', fallback=2)
+        self.logging_payloads = self.config['LOGGING'].getboolean('LogPayloads', fallback=False)
 
-        # TorrentClient
-        self.tor_client = self.config['TORRENTCLIENT'].get('Client', fallback=None).lower()
-        self.tor_client_user = self.config['TORRENTCLIENT'].get('Username', fallback=None)
-        self.tor_client_password = self.config['TORRENTCLIENT'].get('Password', fallback=None)
-        self.tor_client_url = self.config['TORRENTCLIENT'].get('Url', fallback=None)
+        # TorrentClients
+        # [TORRENTCLIENT] plus any number of named [TORRENTCLIENT.name] sections.  Each one is polled independently
+        self.tor_clients = []
+        for section in self.config.sections():
+            if section == 'TORRENTCLIENT' or section.startswith('TORRENTCLIENT.'):
+                self.tor_clients.append(self._load_torrent_client(section))
+
+    def _load_torrent_client(self, section):
+        """
+        Load the settings for a single torrent client section
+        :param section: Name of the config section
+        :return: Dict of client settings
+        """
+
+        client = self.config[section]
+
+        return {
+            'name': section.partition('.')[2] or 'default',
+            'client': client.get('Client', fallback='').lower(),
+            'username': client.get('Username', fallback=None),
+            'password': client.get('Password', fallback=None),
+            'url': client.get('Url', fallback=None),
+            'hostname': client.get('Hostname', fallback=None) or self.hostname,
+            'delay': client.getint('Delay', fallback=self.delay),
+            'adaptive_delay': client.getboolean('AdaptiveDelay', fallback=self.adaptive_delay),
+            'max_delay': client.getint('MaxDelay', fallback=self.max_delay),
+            'workers': client.getint('Workers', fallback=8),
+            'timeout': client.getint('Timeout', fallback=30),
+            'connect_timeout': client.getint('ConnectTimeout', fallback=10),
+            'gzip': client.getboolean('Gzip', fallback=True),
+            'cache_ttl': client.getint('MetadataCacheTTL', fallback=0),
+            'cache_size': client.getint('MetadataCacheSize', fallback=0),
+            'deluge_diff': client.getboolean('DelugeDiff', fallback=False),
+            'auth_lifetime': client.getint('AuthLifetime', fallback=None),
+            'delta': client.getboolean('DeltaMode', fallback=self.delta_mode),
+            'heartbeat': client.getint('Heartbeat', fallback=self.heartbeat),
+            'idle_interval': client.getint('IdleInterval', fallback=self.idle_interval),
+            'rollups': self._parse_list(client.get('Rollups', fallback=None), fallback=self.rollups),
+        }
+
+    def _parse_list(self, value, fallback=None):
+        """
+        Split a comma separated list of names, such as rollups or sinks
+        :param value: Value from the config file
+        :param fallback: Returned when the option isn't set
+        :return: Tuple of lower case names
+        """
+
+        if value is None:
+            return fallback
+
+        return tuple(name.strip().lower() for name in value.split(',') if name.strip())
 
     def _validate_torrent_client(self):
 
-        if self.tor_client not in self.valid_torrent_clients:
-            print('ERROR: {} Is Not a Valid or Support Torrent Client.  Aborting'.format(self.tor_client))
+        if not self.tor_clients:
+            print('ERROR: No Torrent Client Configured.  Aborting')
+            sys.exit(1)
+
+        for tor_client in self.tor_clients:
+            if tor_client['client'] not in self.valid_torrent_clients:
+                print('ERROR: {} Is Not a Valid or Support Torrent Client.  Aborting'.format(tor_client['client']))
+                sys.exit(1)
+
+    def _validate_sinks(self):
+
+        if not self.sinks:
+            print('ERROR: No Sinks Configured.  Aborting')
+            sys.exit(1)
+
+        required = {
+            'influxdb': [('INFLUXDB', 'Address', self.influx_address)],
+            'influxdb2': [('INFLUXDB2', 'Url', self.influx2_url), ('INFLUXDB2', 'Org', self.influx2_org),
+                          ('INFLUXDB2', 'Token', self.influx2_token)],
+            'udp': [('UDP', 'Address', self.udp_address)],
+            'file': [('FILE', 'Directory', self.file_directory)],
+        }
+
+        for sink in self.sinks:
+            if sink not in self.valid_sinks:
+                print('ERROR: {} Is Not a Valid Sink.  Aborting'.format(sink))
+                sys.exit(1)
+
+            for section, option, value in required.get(sink, []):
+                if not value:
+                    print('ERROR: The {} Sink Requires {} Under {}.  Aborting'.format(sink, option, section))
+                    sys.exit(1)
+
+        for precision in (self.influx_precision, self.influx2_precision):
+            if precision not in PRECISIONS:
+                print('ERROR: {} Is Not a Valid Precision.  Aborting'.format(precision))
+                sys.exit(1)
+
+    def _validate_queue_overflow(self):
+
+        if self.influx_queue_overflow not in QueuedWriter.valid_overflow_policies:
+            print('ERROR: {} Is Not a Valid Queue Overflow Policy.  Aborting'.format(self.influx_queue_overflow))
+            sys.exit(1)
+
+        if self.influx_queue_overflow == 'spill' and not self.influx_spool_dir:
+            print('ERROR: The spill Queue Overflow Policy Requires SpoolDir.  Aborting')
+            sys.exit(1)
+
+    def _validate_spool(self):
+
+        if not self.influx_spool_dir or not self.influx_spool_max_size:
+            return
+
+        # Whole segments are dropped to stay under the max size so a single segment can't be bigger than it
+        if self.influx_spool_segment_size > self.influx_spool_max_size:
+            print('ERROR: SpoolSegmentSize ({} MB) Is Larger Than SpoolMaxSize ({} MB).  Aborting'.format(
+                self.influx_spool_segment_size, self.influx_spool_max_size))
+            sys.exit(1)
+
+    def _validate_overrun_policy(self):
+
+        if self.overrun_policy not in PollScheduler.valid_overrun_policies:
+            print('ERROR: {} Is Not a Valid Overrun Policy.  Aborting'.format(self.overrun_policy))
             sys.exit(1)
 
+    def _validate_delay(self):
+
+        # Polls are scheduled on a grid Delay seconds apart so it has to have some width
+        if self.delay < 1:
+            print('ERROR: Delay Must Be At Least 1 Second.  Aborting')
+            sys.exit(1)
+
+        for tor_client in self.tor_clients:
+            if tor_client['delay'] < 1:
+                print('ERROR: Delay For Client {} Must Be At Least 1 Second.  Aborting'.format(tor_client['name']))
+                sys.exit(1)
+
+    def _validate_rollups(self):
+
+        for tor_client in self.tor_clients:
+            for rollup in tor_client['rollups']:
+                if rollup not in ROLLUPS:
+                    print('ERROR: {} Is Not a Valid Rollup.  Aborting'.format(rollup))
+                    sys.exit(1)
+
     def _validate_logging_level(self):
         """
         Make sure we get a valid logging level
@@ -112,46 +293,162 @@ class influxdbSeedbox():
 
         self.output = self.config.output
         self.logger = None
+        self.log_censor = self._build_log_censor()
         self.delay = self.config.delay
 
-        self.influx_client = InfluxDBClient(
-            self.config.influx_address,
-            self.config.influx_port,
-            database=self.config.influx_database,
-            ssl=self.config.influx_ssl,
-            verify_ssl=self.config.influx_verify_ssl
-        )
         self._set_logging()
 
-        if self.config.tor_client == 'deluge':
+        # Every batch goes to each sink.  Only the replayable ones are spooled to and replayed from
+        self.sinks = [self._create_sink(sink) for sink in self.config.sinks]
+        self.replay_sinks = [sink for sink in self.sinks if sink.replayable]
+
+        self.spool = None
+        if self.config.influx_spool_dir and self.replay_sinks:
+            self.spool = Spool(self.config.influx_spool_dir,
+                               self.send_log,
+                               segment_size=self.config.influx_spool_segment_size,
+                               max_size=self.config.influx_spool_max_size)
+
+        self.writer = QueuedWriter(self.write_points,
+                                   self.send_log,
+                                   hostname=self.config.hostname,
+                                   max_size=self.config.influx_queue_size,
+                                   overflow=self.config.influx_queue_overflow,
+                                   spool=self.spool,
+                                   replay_func=self._replay_batch,
+                                   replay_batch_size=self.config.influx_batch_size or 5000,
+                                   replay_rate=self.config.influx_spool_replay_rate,
+                                   extra_metrics=self._sink_metrics)
+
+        # Stats from each client's last cycle, keyed by client name
+        self.client_stats = {}
+        self.stats_server = None
+        if self.config.stats_port:
+            self.stats_server = StatsServer(self.config.stats_address, self.config.stats_port, self.get_stats)
+
+    def get_stats(self):
+        """
+        Current collector stats for the stats endpoint
+        :return: Dict
+        """
+
+        return {
+            'clients': dict(self.client_stats),
+            'writer': self.writer.metrics(),
+            'sinks': {sink.name: sink.metrics() for sink in self.sinks},
+        }
+
+    def _sink_metrics(self):
+        """
+        Byte counters summed over every sink, for the writer's metrics point
+        :return: Dict
+        """
+
+        return {
+            'raw_bytes': sum(sink.raw_bytes for sink in self.sinks),
+            'sent_bytes': sum(sink.sent_bytes for sink in self.sinks),
+        }
+
+    def _create_client(self, client_config):
+        """
+        Create the torrent client object for a client section.  Called from the client's poll task so a client that
+        can't be reached on startup doesn't stop the others
+        :param client_config: Dict of client settings from configManager
+        :return: TorrentClient
+        """
+
+        client_args = {
+            'username': client_config['username'],
+            'password': client_config['password'],
+            'url': client_config['url'],
+            'hostname': client_config['hostname'],
+            'workers': client_config['workers'],
+            'timeout': client_config['timeout'],
+            'connect_timeout': client_config['connect_timeout'],
+            'gzip': client_config['gzip'],
+            'cache_ttl': client_config['cache_ttl'],
+            'cache_size': client_config['cache_size'],
+            'delta': client_config['delta'],
+            'heartbeat': client_config['heartbeat'],
+            'idle_interval': client_config['idle_interval'],
+            'rollups': client_config['rollups'],
+            'auth_lifetime': client_config['auth_lifetime'],
+        }
+
+        if client_config['client'] == 'deluge':
             from clients.deluge import DelugeClient
             if self.output:
-                print('Generating Deluge Client')
-            self.tor_client = DelugeClient(self.send_log,
-                                           username=self.config.tor_client_user,
-                                           password=self.config.tor_client_password,
-                                           url=self.config.tor_client_url,
-                                           hostname=self.config.hostname)
-
-        elif self.config.tor_client == 'utorrent':
+                print('Generating Deluge Client {}'.format(client_config['name']))
+            return DelugeClient(self.send_log, diff=client_config['deluge_diff'], **client_args)
+
+        elif client_config['client'] == 'utorrent':
             from clients.utorrent import UTorrentClient
             if self.output:
-                print('Generating uTorrent Client')
-            self.tor_client = UTorrentClient(self.send_log,
-                                             username=self.config.tor_client_user,
-                                             password=self.config.tor_client_password,
-                                             url=self.config.tor_client_url,
-                                             hostname=self.config.hostname)
-
-        elif self.config.tor_client == 'rtorrent':
+                print('Generating uTorrent Client {}'.format(client_config['name']))
+            return UTorrentClient(self.send_log, **client_args)
+
+        elif client_config['client'] == 'rtorrent':
             from clients.rtorrent import rTorrentClient
             if self.output:
-                print('Generating rTorrent Client')
-            self.tor_client = rTorrentClient(self.send_log,
-                                             username=None,
-                                             password=None,
-                                             url=self.config.tor_client_url,
-                                             hostname=self.config.hostname)
+                print('Generating rTorrent Client {}'.format(client_config['name']))
+            client_args['username'] = None
+            client_args['password'] = None
+            return rTorrentClient(self.send_log, **client_args)
+
+    def _create_sink(self, sink):
+        """
+        Create the sink object for a name in Sinks
+        :param sink: Name of the sink
+        :return: Sink
+        """
+
+        if self.output:
+            print('Generating {} Sink'.format(sink))
+
+        if sink == 'influxdb':
+            from sinks.influxdb import InfluxDBSink
+            return InfluxDBSink(self.send_log,
+                                self.config.influx_address,
+                                port=self.config.influx_port,
+                                database=self.config.influx_database,
+                                username=self.config.influx_user,
+                                password=self.config.influx_password,
+                                ssl=self.config.influx_ssl,
+                                verify_ssl=self.config.influx_verify_ssl,
+                                precision=self.config.influx_precision,
+                                compress=self.config.influx_gzip)
+
+        elif sink == 'influxdb2':
+            from sinks.influxdb2 import InfluxDB2Sink
+            return InfluxDB2Sink(self.send_log,
+                                 self.config.influx2_url,
+                                 self.config.influx2_org,
+                                 self.config.influx2_bucket,
+                                 self.config.influx2_token,
+                                 verify_ssl=self.config.influx2_verify_ssl,
+                                 precision=self.config.influx2_precision,
+                                 compress=self.config.influx2_gzip)
+
+        elif sink == 'udp':
+            from sinks.udp import UDPSink
+            return UDPSink(self.send_log,
+                           self.config.udp_address,
+                           port=self.config.udp_port,
+                           packet_size=self.config.udp_packet_size)
+
+        elif sink == 'file':
+            from sinks.linefile import FileSink
+            return FileSink(self.send_log,
+                            self.config.file_directory,
+                            max_size=self.config.file_max_size,
+                            backups=self.config.file_backups)
+
+        elif sink == 'prometheus':
+            from sinks.prometheus import PrometheusSink
+            return PrometheusSink(self.send_log,
+                                  address=self.config.prometheus_address,
+                                  port=self.config.prometheus_port,
+                                  stale_after=self.config.prometheus_stale_after)
 
     def _set_logging(self):
         """
@@ -169,29 +466,66 @@ class influxdbSeedbox():
             fhandle.setFormatter(formatter)
             self.logger.addHandler(fhandle)
 
-    def send_log(self, msg, level):
+    def send_log(self, msg, level, *args):
         """
-        Used as a shim to write log messages.  Allows us to sanitize input before logging
-        :param msg: Message to log
+        Used as a shim to write log messages.  Allows us to sanitize input before logging.  The message is only
+        formatted and sanitized if it's going to be printed or logged, so pass values in args rather than formatting
+        them first
+        :param msg: Message to log.  Formatted with args using str.format if any are given
         :param level: Level to log message at
+        :param args: Values to format into the message
         :return: None
         """
 
-        if not self.logger:
+        printed, logged = self._log_targets(level)
+        if not printed and not logged:
             return
 
-        if self.output and self.config.valid_log_levels[level.upper()] >= self.config.logging_print_threshold:
+        if args:
+            msg = msg.format(*args)
+
+        if printed:
             print(msg)
 
+        if logged:
+            log_method = getattr(self.logger, level)
+            log_method(self._sanitize_log_message(msg))
+
+    def _log_targets(self, level):
+        """
+        Work out where a message at a level would go, so callers can skip building messages nobody will see
+        :param level: Log level name
+        :return: Tuple of whether it would be printed and whether it would be logged
+        """
+
+        if not self.logger:
+            return False, False
+
         # Make sure a good level was given
-        if not hasattr(self.logger, level):
+        print_level = self.config.valid_log_levels.get(level.upper())
+        if print_level is None:
             self.logger.error('Invalid log level provided to send_log')
-            return
+            return False, False
+
+        printed = self.output and print_level >= self.config.logging_print_threshold
+        logged = self.logger.isEnabledFor(logging.getLevelName(level.upper()))
+        return printed, logged
 
-        output = self._sanitize_log_message(msg)
+    def _build_log_censor(self):
+        """
+        Compile a single pattern matching everything CensorLogs removes so each message only needs one pass
+        :return: Compiled pattern or None if censoring is off
+        """
+
+        if not self.config.logging_censor:
+            return None
+
+        # Longest first so a URL that starts with another client's URL is replaced whole
+        urls = sorted({tor_client['url'] for tor_client in self.config.tor_clients if tor_client['url']}, key=len,
+                      reverse=True)
+        url_pattern = '|'.join(re.escape(url) for url in urls) or '(?!)'
 
-        log_method = getattr(self.logger, level)
-        log_method(output)
+        return re.compile(r'({})|\b\d{{1,3}}\.\d{{1,3}}\.\d{{1,3}}\.\d{{1,3}}\b'.format(url_pattern))
 
     def _sanitize_log_message(self, msg):
         """
@@ -200,73 +534,214 @@ class influxdbSeedbox():
         :return: cleaned message string
         """
 
-        if not self.config.logging_censor:
+        if not self.log_censor:
             return msg
 
-        # Remove server addresses
-        msg = msg.replace(self.config.tor_client_url, 'http://*******:8112/json')
+        # Server addresses and IP addresses
+        return self.log_censor.sub(lambda match: 'http://*******:8112/json' if match.group(1) else '***.***.***.***',
+                                   str(msg))
 
-        # Remove IP addresses
-        for match in re.findall(r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b", msg):
-            msg = msg.replace(match, '***.***.***.***')
+    def write_points(self, points):
+        """
+        Writes the provided points to every sink.  Points are sent in chunks of BatchSize so a full polling cycle
+        only takes a handful of requests.  Chunks that a replayable sink fails to write are saved to the spool if one is
+        configured
+        :param points: List of line protocol strings to write
+        :return: True if every chunk was written to every sink
+        """
+        if not points:
+            return True
+
+        # Dumping every point costs more than collecting them with thousands of torrents, so it's opt in.  Joining them
+        # is the expensive part so it's skipped unless debug messages are going somewhere
+        if self.config.logging_payloads and any(self._log_targets('debug')):
+            self.send_log('\n'.join(points), 'debug')
+        self.send_log('Writing {} points', 'info', len(points))
+
+        batch_size = self.config.influx_batch_size if self.config.influx_batch_size > 0 else len(points)
+
+        success = True
+        for i in range(0, len(points), batch_size):
+            batch = points[i:i + batch_size]
+            spool = False
+
+            for sink in self.sinks:
+                try:
+                    if sink.write(batch):
+                        continue
+                except WriteRejected:
+                    # It would only be rejected again on replay
+                    success = False
+                    continue
 
-        return msg
+                success = False
+                spool = spool or sink.replayable
 
-    def write_influx_data(self, json_data):
+            if spool and self.spool:
+                self.send_log('Saving {} points to the spool', 'warning', len(batch))
+                self.spool.append('\n'.join(batch))
+
+        return success
+
+    def _replay_batch(self, batch):
         """
-        Writes the provided JSON to the database
-        :param json_data:
-        :return:
+        Write a batch from the spool to the replayable sinks.  One that already took the batch gets it again, which
+        InfluxDB treats as an overwrite of the same points.  A sink that rejects the batch counts as done with it so
+        one bad batch doesn't hold up the rest of the spool
+        :param batch: List of line protocol strings
+        :return: True if every replayable sink took or rejected the batch
         """
-        self.send_log(json_data, 'info')
 
-        # TODO This bit of fuckery may turn out to not be a good idea.
-        """
-        The idea is we only write 1 series at a time but we can get passed a bunch of series.  If the incoming list
-        has more than 1 thing, we know it's a bunch of points to write.  We loop through them and recursively call this
-        method which each series.  The recursive call will only have 1 series so it passes on to be written to Influx.
+        success = True
+        for sink in self.replay_sinks:
+            try:
+                if not sink.write(batch):
+                    success = False
+            except WriteRejected:
+                self.send_log('{} rejected {} spooled points.  Dropping them', 'error', sink.name, len(batch))
+
+        return success
 
-        I know, brilliant right?  Probably not
+    def _collect(self, name, tor_client, timestamp):
+        """
+        Run a single collection cycle against a client and queue the points to be written along with a point
+        describing the cycle
+        :param name: Name of the client section
+        :param tor_client: TorrentClient
+        :param timestamp: Time the cycle started in nanoseconds.  Every point from the cycle gets the same time
+        :return: None
         """
-        if len(json_data) > 1:
-            for series in json_data:
-                self.write_influx_data(series)
-            return
 
-        try:
-            self.influx_client.write_points(json_data)
-        except (InfluxDBClientError, ConnectionError, InfluxDBServerError) as e:
-            if hasattr(e, 'code') and e.code == 404:
+        stats = tor_client.stats
+        stats.reset()
+        start = time.monotonic()
 
-                msg = 'Database {} Does Not Exist.  Attempting To Create'.format(self.config.influx_database)
-                self.send_log(msg, 'error')
+        tor_client.get_all_torrents()
 
-                # TODO Grab exception here
-                self.influx_client.create_database(self.config.influx_database)
-                self.influx_client.write_points(json_data)
+        # Collect everything from this cycle so it can be written in as few requests as possible
+        points = []
+        with stats.phase('build'):
+            torrent_lines = tor_client.process_torrents(timestamp=timestamp)
+        if torrent_lines:
+            points.extend(torrent_lines)
+        #tor_client.get_active_plugins()
+        with stats.phase('rollup'):
+            rollup_lines = tor_client.process_rollups(timestamp=timestamp)
+        if rollup_lines:
+            points.extend(rollup_lines)
 
-                return
+        stats.torrents = len(tor_client.torrent_list)
+        stats.points = len(points)
+        stats.cycle_time = time.monotonic() - start
 
-            self.send_log('Failed to write data to InfluxDB', 'error')
+        cycle_stats = stats.as_dict()
+        self.client_stats[name] = cycle_stats
 
-            print('ERROR: Failed To Write To InfluxDB')
-            print(e)
+        tags = [('client', tor_client.torrent_client), ('host', tor_client.hostname)]
+        points.append(make_line('seedbox_collector', tags, sorted(cycle_stats.items()), timestamp))
 
-        self.send_log('Written To Influx: {}'.format(json_data), 'debug')
+        self.writer.put(points)
 
+    async def _poll_client(self, client_config):
+        """
+        Poll a single client on its own fixed cadence.  The blocking client calls, and queuing the points for the
+        writer, run in the poll executor so clients don't wait on each other.  A failure or a collection that runs past
+        the next poll only affects this client
+        :param client_config: Dict of client settings from configManager
+        :return: None
+        """
 
+        loop = asyncio.get_running_loop()
+        name = client_config['name']
+        tor_client = None
+        scheduler = PollScheduler(client_config['delay'], overrun=self.config.overrun_policy,
+                                  jitter=self.config.jitter)
+        adaptive = None
+        if client_config['adaptive_delay']:
+            adaptive = AdaptiveInterval(client_config['delay'], client_config['max_delay'])
+
+        await asyncio.sleep(scheduler.start())
 
-    def run(self):
         while True:
-            self.tor_client.get_all_torrents()
-            torrent_json = self.tor_client.process_torrents()
-            if torrent_json:
-                self.write_influx_data(torrent_json)
-            #self.tor_client.get_active_plugins()
-            tracker_json = self.tor_client.process_tracker_list()
-            if tracker_json:
-                self.write_influx_data(tracker_json)
-            time.sleep(self.delay)
+            # Points may sit in the write queue for a while so they're stamped with the time the cycle started
+            timestamp = time.time_ns()
+            started = time.monotonic()
+            failed = False
+
+            try:
+                if not tor_client:
+                    tor_client = await loop.run_in_executor(self.poll_executor, self._create_client, client_config)
+
+                await loop.run_in_executor(self.poll_executor, self._collect, name, tor_client, timestamp)
+            except (Exception, SystemExit) as e:
+                # Clients exit when they can't authenticate.  Keep the other clients running and try again next poll
+                failed = True
+                if not tor_client:
+                    self.send_log('Failed to create client {}: {}', 'error', name, e)
+                else:
+                    self.send_log('Failed to poll client {}: {}', 'error', name, e)
+
+            if adaptive:
+                scheduler.interval = self._adapt_interval(adaptive, name, failed, time.monotonic() - started)
+
+            missed = scheduler.advance()
+            if tor_client:
+                tor_client.stats.overruns = scheduler.overruns
+                tor_client.stats.interval = scheduler.interval
+            if missed:
+                self.send_log('Poll of client {} took {:.2f} seconds and overran {} poll(s).  Overrun policy is {}',
+                              'warning', name, time.monotonic() - started, missed, scheduler.overrun)
+
+            await asyncio.sleep(scheduler.wait_time())
+
+    def _adapt_interval(self, adaptive, name, failed, cycle_time):
+        """
+        Feed the cycle that just finished to the client's AdaptiveInterval
+        :param adaptive: AdaptiveInterval
+        :param name: Name of the client section
+        :param failed: True if the cycle raised
+        :param cycle_time: Seconds the cycle took
+        :return: New interval in seconds
+        """
+
+        latency = None
+        error_rate = 1.0
+        if not failed:
+            stats = self.client_stats[name]
+            if stats['requests']:
+                # Lookups run in parallel so this is the wall time per request, which is what the poll pays for
+                client_time = stats['auth_time'] + stats['list_time'] + stats['lookup_time']
+                latency = client_time / stats['requests']
+            error_rate = stats['errors'] / max(stats['requests'], 1)
+
+        # More than a cycle per client waiting means InfluxDB isn't keeping up with polling
+        backlog = self.writer.queue.qsize() > len(self.config.tor_clients)
+
+        previous = adaptive.interval
+        interval = adaptive.update(cycle_time, latency=latency, error_rate=error_rate, backlog=backlog)
+        if interval > previous:
+            self.send_log('Client {} is struggling.  Poll interval raised from {:.1f} to {:.1f} seconds', 'info', name,
+                          previous, interval)
+        elif interval < previous:
+            self.send_log('Poll interval for client {} lowered from {:.1f} to {:.1f} seconds', 'debug', name, previous,
+                          interval)
+
+        return interval
+
+    async def _run(self):
+
+        # One thread per client for polling.  Writes all go through the writer's background thread
+        self.poll_executor = ThreadPoolExecutor(max_workers=len(self.config.tor_clients))
+        for sink in self.sinks:
+            sink.start()
+        self.writer.start()
+        if self.stats_server:
+            self.stats_server.start()
+
+        await asyncio.gather(*[self._poll_client(client_config) for client_config in self.config.tor_clients])
+
+    def run(self):
+        asyncio.run(self._run())
 
 
 
@@ -0,0 +1,159 @@
+"""
+Minimal InfluxDB line protocol serializer.  Builds each line straight from the values instead of going through point
+dicts and the influxdb library's JSON to line protocol conversion.  Output matches the library's for the same point.
+Also parses lines back for the sinks that need values rather than text
+"""
+
+import re
+
+def escape_tag(value):
+    """
+    Escape a measurement name or tag value
+    :param value:
+    :return: Escaped string.  Empty if value is None
+    """
+
+    if value is None:
+        return ''
+
+    # Chained replace is much faster than str.translate for the short strings we deal with
+    value = str(value).replace('\\', '\\\\').replace(' ', '\\ ').replace(',', '\\,')
+    return value.replace('=', '\\=').replace('\n', '\\n')
+
+
+def _quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def format_value(value):
+    """
+    Format a field value.  Strings are quoted, ints get the i suffix, floats and bools are written as is
+    :param value:
+    :return: Formatted value.  Empty if value is None
+    """
+
+    if value is None:
+        return ''
+
+    if isinstance(value, str):
+        return _quote(value)
+
+    if isinstance(value, bool):
+        return str(value)
+
+    if isinstance(value, int):
+        return str(value) + 'i'
+
+    if isinstance(value, float):
+        return repr(value)
+
+    return _quote(str(value))
+
+
+def make_line(measurement, tags, fields, timestamp=None):
+    """
+    Build a single line of line protocol.  Tags and fields with empty values are left out like the influxdb library
+    does.  Pass tags sorted by key, InfluxDB handles writes faster that way.
+
+    Keys are written as is so they must not need escaping.  They're always constants in this project
+    :param measurement: Measurement name
+    :param tags: List of (key, value) tuples
+    :param fields: List of (key, value) tuples
+    :param timestamp: Optional integer timestamp in the write precision
+    :return: Line protocol string
+    """
+
+    line = escape_tag(measurement)
+
+    for key, value in tags:
+        value = escape_tag(value)
+        if value:
+            line += ',' + key + '=' + value
+
+    line += ' ' + ','.join([key + '=' + format_value(value) for key, value in fields if value is not None])
+
+    if timestamp is not None:
+        line += ' ' + str(int(timestamp))
+
+    return line
+
+
+# Timestamp precisions InfluxDB accepts and the number of nanoseconds in each unit
+PRECISIONS = {'ns': 1, 'u': 10 ** 3, 'us': 10 ** 3, 'ms': 10 ** 6, 's': 10 ** 9}
+
+
+def set_precision(line, precision):
+    """
+    Convert the nanosecond timestamp on a line to a coarser precision.  Lines without a timestamp are returned as is
+    :param line: Line protocol string
+    :param precision: Key of PRECISIONS
+    :return: Line protocol string
+    """
+
+    divisor = PRECISIONS[precision]
+    if divisor == 1:
+        return line
+
+    i = line.rfind(' ')
+    timestamp = line[i + 1:]
+    if not timestamp.isdigit():
+        return line
+
+    return line[:i + 1] + str(int(timestamp) // divisor)
+
+
+_SERIES_PART = re.compile(r'(?:[^,\\]|\\.)+')
+_SERIES_END = re.compile(r'(?:[^ \\]|\\.)*')
+_FIELD = re.compile(r'([^=]+)=("(?:[^"\\]|\\.)*"|[^, ]*)')
+_ESCAPED = re.compile(r'\\(.)')
+
+
+def _unescape(value):
+    return _ESCAPED.sub(r'\1', value) if '\\' in value else value
+
+
+def _parse_value(value):
+
+    if value.startswith('"'):
+        return _unescape(value[1:-1])
+
+    if value.endswith('i') or value.endswith('u'):
+        return int(value[:-1])
+
+    if value in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+
+    if value in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+
+    return float(value)
+
+
+def parse_line(line):
+    """
+    Split a line of line protocol back into its parts.  For sinks that need the values rather than the text.  Tag
+    and field keys are expected to need no escaping, the same as make_line
+    :param line: Line protocol string
+    :return: Tuple of measurement, dict of tags, dict of fields and the timestamp (None if there isn't one)
+    """
+
+    series_end = _SERIES_END.match(line).end()
+    parts = [_unescape(part) for part in _SERIES_PART.findall(line[:series_end])]
+    measurement = parts[0]
+    tags = dict(part.split('=', 1) for part in parts[1:])
+
+    fields = {}
+    pos = series_end + 1
+    while True:
+        match = _FIELD.match(line, pos)
+        if not match:
+            raise ValueError('Invalid field in line protocol: {}'.format(line))
+        fields[match.group(1)] = _parse_value(match.group(2))
+        pos = match.end()
+        if pos >= len(line) or line[pos] == ' ':
+            break
+        pos += 1
+
+    timestamp = int(line[pos + 1:]) if pos + 1 < len(line) else None
+
+    return measurement, tags, fields, timestamp
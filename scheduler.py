@@ -0,0 +1,140 @@
+import random
+import time
+
+"""
+Fixed cadence scheduling for the poll tasks.  Polls are due on a grid of monotonic times Delay seconds apart, so the
+time a collection takes doesn't push every later poll back.  With AdaptiveDelay the spacing of the grid follows how
+the client is coping
+"""
+
+class PollScheduler:
+
+    valid_overrun_policies = ['skip', 'catch_up']
+
+    # With catch_up, never try to run more than this many late polls back to back
+    max_catch_up = 3
+
+    def __init__(self, interval, overrun='skip', jitter=0, clock=time.monotonic):
+        """
+        :param interval: Seconds between polls
+        :param overrun: What to do when a poll runs past the next one.  skip waits for the next slot on the grid,
+        catch_up runs the missed polls straight away
+        :param jitter: Max random seconds added to the first poll so several instances don't all poll at once
+        :param clock: Monotonic clock, in seconds
+        """
+
+        self.interval = interval
+        self.overrun = overrun
+        self.jitter = jitter
+        self.clock = clock
+        self.next_run = None
+
+        # Metrics
+        self.overruns = 0
+
+    def start(self):
+        """
+        Set the first poll time
+        :return: Seconds to wait before the first poll
+        """
+
+        delay = random.uniform(0, self.jitter) if self.jitter else 0
+        self.next_run = self.clock() + delay
+
+        return delay
+
+    def advance(self):
+        """
+        Move on to the next slot once a poll has finished
+        :return: Number of polls missed because the last one overran
+        """
+
+        now = self.clock()
+        self.next_run += self.interval
+
+        if now <= self.next_run:
+            return 0
+
+        # Whole slots that passed while the poll was running
+        missed = int((now - self.next_run) // self.interval) + 1
+        self.overruns += 1
+
+        if self.overrun == 'catch_up' and missed <= self.max_catch_up:
+            # Keep the grid as is.  The late slots are already due so they run back to back
+            return missed
+
+        # Jump to the next slot still ahead of us so the cadence stays on the same grid
+        self.next_run += missed * self.interval
+
+        return missed
+
+    def wait_time(self):
+        """
+        :return: Seconds until the next poll is due.  0 if it's already due
+        """
+
+        return max(0, self.next_run - self.clock())
+
+
+class AdaptiveInterval:
+    """
+    Works out the poll interval from how the last cycle went.  The interval backs off quickly when the client or the
+    writer is struggling and comes back down slowly toward the minimum while things are healthy, so a busy client
+    isn't hammered at the same rate that made it slow
+    """
+
+    # Keep the cycle under this fraction of the interval so the client gets time to itself between polls
+    target_load = 0.5
+
+    # Multiplier applied to the interval on a bad cycle, and to bring it back down on a good one
+    backoff = 2.0
+    recovery = 0.9
+
+    # A cycle is bad if requests take this many times longer than usual or this fraction of them fail
+    latency_factor = 3.0
+    max_error_rate = 0.1
+
+    def __init__(self, min_interval, max_interval):
+        """
+        :param min_interval: Seconds between polls while everything is healthy.  Also the starting interval.  At least 1
+        :param max_interval: Most seconds the interval backs off to
+        """
+
+        # The cycle time is measured against the interval so it can't be 0
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.interval = self.min_interval
+
+        # Usual seconds per request, averaged over healthy cycles
+        self.baseline_latency = None
+
+    def update(self, cycle_time, latency=None, error_rate=0, backlog=False):
+        """
+        Adjust the interval after a cycle
+        :param cycle_time: Seconds the cycle took
+        :param latency: Average seconds per request to the client.  None if nothing was requested
+        :param error_rate: Failed requests per request.  1 if the whole cycle failed
+        :param backlog: True if the writer is falling behind
+        :return: New interval in seconds
+        """
+
+        load = cycle_time / self.interval
+        slow = latency is not None and self.baseline_latency is not None and \
+            latency > self.baseline_latency * self.latency_factor
+
+        if load > self.target_load or slow or error_rate > self.max_error_rate or backlog:
+            # Jump straight to an interval the cycle fits in if doubling isn't enough
+            interval = max(self.interval * self.backoff, cycle_time / self.target_load)
+            self.interval = min(self.max_interval, interval)
+            return self.interval
+
+        if latency is not None:
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency += (latency - self.baseline_latency) * 0.2
+
+        if load < self.target_load / 2:
+            self.interval = max(self.min_interval, self.interval * self.recovery)
+
+        return self.interval
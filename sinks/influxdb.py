@@ -0,0 +1,83 @@
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from requests.exceptions import RequestException
+
+from sinks.sink import Sink, WriteRejected
+
+
+class InfluxDBSink(Sink):
+    """
+    InfluxDB 1.x over HTTP.  Line protocol is posted as is to the write endpoint
+    """
+
+    replayable = True
+
+    def __init__(self, logger, address, port=8086, database='seedbox', username='', password='', ssl=False,
+                 verify_ssl=True, precision='ns', compress=False):
+
+        Sink.__init__(self, logger, 'InfluxDB', precision=precision, compress=compress)
+        self.database = database
+        # 1.x calls microseconds u
+        self.params = {'db': database, 'precision': 'u' if precision == 'us' else precision}
+        self.headers = {'Content-Type': 'application/octet-stream'}
+        if compress:
+            self.headers['Content-Encoding'] = 'gzip'
+
+        self.influx_client = InfluxDBClient(
+            address,
+            port,
+            username=username or 'root',
+            password=password or 'root',
+            database=database,
+            ssl=ssl,
+            verify_ssl=verify_ssl
+        )
+
+    def write(self, lines):
+        """
+        Write a single batch of points in one request.  If the database does not exist it is created and the batch is
+        retried
+        :param lines: List of line protocol strings
+        :return: True on success.  Raises WriteRejected if InfluxDB refused the batch
+        """
+
+        data, raw_size = self.encode(lines)
+
+        try:
+            try:
+                self._post_lines(data)
+            except InfluxDBClientError as e:
+                if e.code != 404:
+                    raise
+
+                self.send_log('Database {} Does Not Exist.  Attempting To Create', 'error', self.database)
+                self.influx_client.create_database(self.database)
+                self._post_lines(data)
+        except InfluxDBClientError as e:
+            if self.is_rejection(e.code):
+                self.send_log('InfluxDB rejected {} points: {}', 'error', len(lines), e)
+                raise WriteRejected(e)
+
+            self.send_log('Failed to write data to InfluxDB: {}', 'error', e)
+            return False
+        except (ConnectionError, RequestException, InfluxDBServerError) as e:
+            self.send_log('Failed to write data to InfluxDB: {}', 'error', e)
+            return False
+
+        self.count_bytes(raw_size, len(data))
+        self.send_log('Written {} Points ({} bytes, {} sent) To Influx', 'debug', len(lines), raw_size, len(data))
+        return True
+
+    def _post_lines(self, data):
+        """
+        Post encoded line protocol to the write endpoint
+        :param data: bytes
+        :return: None
+        """
+
+        self.influx_client.request(url='write',
+                                   method='POST',
+                                   params=self.params,
+                                   data=data,
+                                   expected_response_code=204,
+                                   headers=self.headers)
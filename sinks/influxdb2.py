@@ -0,0 +1,69 @@
+import requests
+from requests.exceptions import RequestException
+
+from sinks.sink import Sink, WriteRejected
+
+
+class InfluxDB2Sink(Sink):
+    """
+    InfluxDB 2.x write API.  Points go to a bucket in an organization and the request is authorized with an API token
+    """
+
+    replayable = True
+
+    def __init__(self, logger, url, org, bucket, token, verify_ssl=True, timeout=30, precision='ns', compress=False):
+        """
+        :param logger: send_log method of the main class
+        :param url: Base URL of the server, e.g. http://localhost:8086
+        :param org: Organization name or ID
+        :param bucket: Bucket to write to
+        :param token: API token with write access to the bucket
+        :param verify_ssl: Verify the server's certificate
+        :param timeout: Seconds to wait on a write
+        :param precision: Timestamp precision to send
+        :param compress: Gzip request bodies
+        """
+
+        Sink.__init__(self, logger, 'InfluxDB2', precision=precision, compress=compress)
+        self.write_url = url.rstrip('/') + '/api/v2/write'
+        # 2.x calls microseconds us
+        self.params = {'org': org, 'bucket': bucket, 'precision': 'us' if precision == 'u' else precision}
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.verify = verify_ssl
+        self.session.headers.update({
+            'Authorization': 'Token {}'.format(token),
+            'Content-Type': 'text/plain; charset=utf-8',
+        })
+        if compress:
+            self.session.headers['Content-Encoding'] = 'gzip'
+
+    def write(self, lines):
+        """
+        Write a single batch of points in one request
+        :param lines: List of line protocol strings
+        :return: True on success.  Raises WriteRejected if InfluxDB refused the batch
+        """
+
+        data, raw_size = self.encode(lines)
+
+        try:
+            response = self.session.post(self.write_url, params=self.params, data=data, timeout=self.timeout)
+        except RequestException as e:
+            self.send_log('Failed to write data to InfluxDB2: {}', 'error', e)
+            return False
+
+        if self.is_rejection(response.status_code):
+            self.send_log('InfluxDB2 rejected {} points.  Status {}: {}', 'error', len(lines), response.status_code,
+                          response.text)
+            raise WriteRejected(response.text)
+
+        if response.status_code != 204:
+            self.send_log('Failed to write data to InfluxDB2.  Status {}: {}', 'error', response.status_code,
+                          response.text)
+            return False
+
+        self.count_bytes(raw_size, len(data))
+        self.send_log('Written {} Points ({} bytes, {} sent) To InfluxDB2', 'debug', len(lines), raw_size, len(data))
+        return True
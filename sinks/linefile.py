@@ -0,0 +1,62 @@
+import os
+
+from sinks.sink import Sink
+
+
+class FileSink(Sink):
+    """
+    Appends line protocol to a local file for bulk import later, e.g. with influx -import or influx write.  The file is
+    rotated once it passes max_size, keeping a set number of old files as seedbox.lp.1, seedbox.lp.2 and so on
+    """
+
+    def __init__(self, logger, directory, filename='seedbox.lp', max_size=100, backups=5):
+        """
+        :param logger: send_log method of the main class
+        :param directory: Directory the files are written to
+        :param filename: Name of the current file
+        :param max_size: Size in MB to rotate the file at.  0 never rotates
+        :param backups: Number of rotated files to keep
+        """
+
+        Sink.__init__(self, logger, 'File')
+        self.path = os.path.join(directory, filename)
+        self.max_size = max_size * 1024 * 1024
+        self.backups = backups
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, lines):
+
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+
+        try:
+            if self.max_size and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_size:
+                self._rotate()
+
+            with open(self.path, 'ab') as f:
+                f.write(data)
+        except OSError as e:
+            self.send_log('Failed to write points to {}: {}', 'error', self.path, e)
+            return False
+
+        self.count_bytes(len(data), len(data))
+        self.send_log('Written {} Points ({} bytes) To {}', 'debug', len(lines), len(data), self.path)
+        return True
+
+    def _rotate(self):
+        """
+        Shift each old file up one, dropping the oldest, and move the current file to .1
+        :return: None
+        """
+
+        if not self.backups:
+            os.remove(self.path)
+            return
+
+        for i in range(self.backups - 1, 0, -1):
+            src = '{}.{}'.format(self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '{}.{}'.format(self.path, i + 1))
+
+        os.replace(self.path, self.path + '.1')
+        self.send_log('Rotated {}', 'info', self.path)
@@ -0,0 +1,125 @@
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lineprotocol import parse_line
+from sinks.sink import Sink
+
+
+_INVALID_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _metric_name(name):
+    name = _INVALID_NAME.sub('_', name)
+    return '_' + name if name[:1].isdigit() else name
+
+
+def _label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class PrometheusSink(Sink):
+    """
+    Keeps the latest value of every numeric field in memory and serves them in the Prometheus text format for a
+    scraper to pull.  Each field becomes a gauge named <measurement>_<field> with the tags as labels.  String fields
+    are left out.  Series that haven't been written for stale_after seconds are dropped, so removed torrents go away
+    """
+
+    def __init__(self, logger, address='127.0.0.1', port=9166, stale_after=600):
+        """
+        :param logger: send_log method of the main class
+        :param address: Address to serve /metrics on
+        :param port: Port to serve /metrics on
+        :param stale_after: Seconds a series is kept after it was last written.  Needs to be longer than IdleInterval
+        """
+
+        Sink.__init__(self, logger, 'Prometheus')
+        self.address = address
+        self.port = port
+        self.stale_after = stale_after
+        self.server = None
+        self.thread = None
+
+        # Metric name -> {label string: (value, time last written)}
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+
+        render = self.render
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.address, self.port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='PrometheusSink', daemon=True)
+        self.thread.start()
+
+    def write(self, lines):
+
+        now = time.monotonic()
+        updates = []
+
+        for line in lines:
+            try:
+                measurement, tags, fields, _ = parse_line(line)
+            except ValueError as e:
+                self.send_log('Failed to parse point for Prometheus: {}', 'error', e)
+                continue
+
+            labels = ','.join('{}="{}"'.format(_metric_name(key), _label_value(value))
+                              for key, value in sorted(tags.items()))
+
+            for field, value in fields.items():
+                if isinstance(value, str):
+                    continue
+                updates.append((_metric_name('{}_{}'.format(measurement, field)), labels, float(value)))
+
+        with self.lock:
+            for name, labels, value in updates:
+                self.series.setdefault(name, {})[labels] = (value, now)
+
+        return True
+
+    def render(self):
+        """
+        Build the text served to scrapers, dropping stale series on the way
+        :return: String in the Prometheus text exposition format
+        """
+
+        cutoff = time.monotonic() - self.stale_after
+        output = []
+
+        with self.lock:
+            for name in sorted(self.series):
+                values = self.series[name]
+                for labels in [labels for labels, (_, seen) in values.items() if seen < cutoff]:
+                    del values[labels]
+                if not values:
+                    del self.series[name]
+                    continue
+
+                output.append('# TYPE {} gauge'.format(name))
+                for labels, (value, _) in values.items():
+                    if labels:
+                        output.append('{}{{{}}} {!r}'.format(name, labels, value))
+                    else:
+                        output.append('{} {!r}'.format(name, value))
+
+        return '\n'.join(output) + '\n' if output else ''
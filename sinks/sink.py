@@ -0,0 +1,112 @@
+"""
+Base class for output sinks
+"""
+
+import gzip
+
+from lineprotocol import set_precision
+
+
+class WriteRejected(Exception):
+    """
+    The server refused the batch itself, e.g. a field type conflict or a malformed point.  Sending it again won't help
+    so it isn't spooled
+    """
+
+
+class Sink:
+    """
+    Stub class to base output sinks on.  Sinks take whole batches of line protocol strings so each transport can send
+    a batch however is cheapest for it
+    """
+
+    # Failed batches can be spooled and replayed to this sink later.  Only worth it where a write is either fully
+    # stored or rejected
+    replayable = False
+
+    # Client errors that can clear up without the batch changing.  Bad credentials, a missing database or bucket and
+    # rate limiting.  Any other 4xx is a rejection of the batch
+    retryable_codes = [401, 403, 404, 408, 429]
+
+    def __init__(self, logger, name, precision='ns', compress=False):
+        """
+        :param logger: send_log method of the main class
+        :param name: Name used in log messages
+        :param precision: Timestamp precision to send.  Points are built with nanosecond timestamps
+        :param compress: Gzip the encoded batch
+        """
+
+        self.send_log = logger
+        self.name = name
+        self.precision = precision
+        self.compress = compress
+
+        # Bytes of line protocol written and bytes actually sent after compression, since startup
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def start(self):
+        """
+        Start anything the sink runs in the background
+        :return: None
+        """
+
+        pass
+
+    def write(self, lines):
+        """
+        Write a batch of points
+        :param lines: List of line protocol strings
+        :return: True on success.  Raises WriteRejected if the server refused the batch
+        """
+
+        raise NotImplementedError
+
+    def is_rejection(self, status_code):
+        """
+        Whether a failed write's HTTP status means the batch will never be accepted
+        :param status_code: HTTP status code of the response
+        :return: bool
+        """
+
+        return status_code is not None and 400 <= status_code < 500 and status_code not in self.retryable_codes
+
+    def encode(self, lines):
+        """
+        Turn a batch into the body to send, converting the timestamps and compressing it if the sink is set to
+        :param lines: List of line protocol strings
+        :return: Tuple of the body and its size before compression
+        """
+
+        if self.precision != 'ns':
+            lines = [set_precision(line, self.precision) for line in lines]
+
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        raw_size = len(data)
+        if self.compress:
+            # Points repeat the same measurement, tags and field keys so they compress well over 10 to 1.  Level 6 gets
+            # most of what 9 does in half the time
+            data = gzip.compress(data, compresslevel=6)
+
+        return data, raw_size
+
+    def count_bytes(self, raw_size, sent_size):
+        """
+        Add a successful write to the byte counters
+        :param raw_size: Bytes of line protocol
+        :param sent_size: Bytes sent
+        :return: None
+        """
+
+        self.raw_bytes += raw_size
+        self.sent_bytes += sent_size
+
+    def metrics(self):
+        """
+        :return: Dict of the sink's counters
+        """
+
+        return {
+            'raw_bytes': self.raw_bytes,
+            'sent_bytes': self.sent_bytes,
+        }
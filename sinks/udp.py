@@ -0,0 +1,54 @@
+import socket
+
+from sinks.sink import Sink
+
+
+class UDPSink(Sink):
+    """
+    InfluxDB line protocol over UDP.  Lines are packed into as few datagrams as fit under the packet size and sent
+    without waiting on a reply, so a write costs nothing but the sends.  Nothing is known about whether they arrived
+    """
+
+    def __init__(self, logger, address, port=8089, packet_size=1400):
+        """
+        :param logger: send_log method of the main class
+        :param address: Address of the UDP listener
+        :param port: Port of the UDP listener
+        :param packet_size: Max bytes per datagram.  Keep it under the path MTU so datagrams aren't fragmented
+        """
+
+        Sink.__init__(self, logger, 'UDP')
+        self.address = (address, port)
+        self.packet_size = packet_size
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, lines):
+
+        packets = 0
+        sent = 0
+        packet = bytearray()
+
+        try:
+            for line in lines:
+                data = line.encode('utf-8') + b'\n'
+
+                if packet and len(packet) + len(data) > self.packet_size:
+                    self.sock.sendto(packet, self.address)
+                    packets += 1
+                    sent += len(packet)
+                    packet = bytearray()
+
+                # A line bigger than packet_size still goes out, alone in an oversized datagram
+                packet += data
+
+            if packet:
+                self.sock.sendto(packet, self.address)
+                packets += 1
+                sent += len(packet)
+        except OSError as e:
+            self.send_log('Failed to send points over UDP: {}', 'error', e)
+            return False
+
+        self.count_bytes(sent, sent)
+        self.send_log('Sent {} Points In {} UDP Packets', 'debug', len(lines), packets)
+        return True
@@ -0,0 +1,136 @@
+import os
+import threading
+
+"""
+Durable on-disk spool for points that couldn't be written to InfluxDB.  Failed batches are appended as line protocol to
+segment files which are replayed in order once writes start succeeding again
+"""
+
+class Spool:
+
+    def __init__(self, directory, logger, segment_size=16, max_size=1024):
+        """
+        :param directory: Directory segment files are kept in
+        :param logger: send_log method of the main class
+        :param segment_size: Size in MB a segment is allowed to grow to before a new one is started
+        :param max_size: Total size in MB of all segments.  The oldest segments are dropped past this.  0 is unlimited
+        """
+
+        self.directory = directory
+        self.send_log = logger
+        self.segment_size = segment_size * 1024 * 1024
+        self.max_size = max_size * 1024 * 1024
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Pick up anything left over from a previous run
+        self.segments = sorted(f for f in os.listdir(self.directory) if f.endswith('.lp'))
+
+        # Replay position within the oldest segment.  Not persisted, a segment interrupted by a restart is replayed
+        # from the start.  InfluxDB overwrites points with the same series and timestamp so this only costs time
+        self.offset = 0
+        self.pending_offset = 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def _next_segment(self):
+
+        if self.segments:
+            number = int(self.segments[-1].split('.')[0]) + 1
+        else:
+            number = 0
+
+        segment = '{:010d}.lp'.format(number)
+        self.segments.append(segment)
+        return segment
+
+    def _total_size(self):
+        return sum(os.path.getsize(self._path(segment)) for segment in self.segments)
+
+    def has_data(self):
+
+        with self.lock:
+            return bool(self.segments)
+
+    def append(self, lines):
+        """
+        Append line protocol to the newest segment, starting a new segment when it's full
+        :param lines: Line protocol string, one point per line
+        :return: None
+        """
+
+        if not lines:
+            return
+
+        if not lines.endswith('\n'):
+            lines += '\n'
+
+        with self.lock:
+            if not self.segments or os.path.getsize(self._path(self.segments[-1])) >= self.segment_size:
+                segment = self._next_segment()
+            else:
+                segment = self.segments[-1]
+
+            try:
+                with open(self._path(segment), 'a', encoding='utf-8') as f:
+                    f.write(lines)
+            except OSError as e:
+                self.send_log('Failed to write to spool {}: {}', 'error', segment, e)
+                return
+
+            self._enforce_max_size()
+
+    def _enforce_max_size(self):
+
+        if not self.max_size:
+            return
+
+        while len(self.segments) > 1 and self._total_size() > self.max_size:
+            segment = self.segments.pop(0)
+            os.remove(self._path(segment))
+            self.offset = 0
+            self.pending_offset = 0
+            self.send_log('Spool is over its max size.  Dropped segment {}', 'error', segment)
+
+    def read(self, max_lines):
+        """
+        Read the next chunk of lines to replay from the oldest segment.  Call commit() once they've been written to
+        move on, otherwise the same lines are returned next time
+        :param max_lines: Max number of lines to return
+        :return: List of lines.  Empty if there's nothing to replay
+        """
+
+        with self.lock:
+            if not self.segments:
+                return []
+
+            lines = []
+            with open(self._path(self.segments[0]), 'r', encoding='utf-8') as f:
+                f.seek(self.offset)
+                while len(lines) < max_lines:
+                    line = f.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        lines.append(line.rstrip('\n'))
+                self.pending_offset = f.tell()
+
+            return lines
+
+    def commit(self):
+        """
+        Mark the lines from the last read() as written.  Segments are deleted once fully replayed
+        :return: None
+        """
+
+        with self.lock:
+            if not self.segments:
+                return
+
+            self.offset = self.pending_offset
+            if self.offset >= os.path.getsize(self._path(self.segments[0])):
+                os.remove(self._path(self.segments.pop(0)))
+                self.offset = 0
+                self.pending_offset = 0
@@ -0,0 +1,46 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Optional local HTTP endpoint serving the collector's own stats as JSON, for checking on a busy box without going
+through InfluxDB
+"""
+
+class StatsServer:
+
+    def __init__(self, address, port, get_stats):
+        """
+        :param address: Address to listen on
+        :param port: Port to listen on
+        :param get_stats: Callable returning a JSON serializable dict of stats
+        """
+
+        self.address = address
+        self.port = port
+        self.get_stats = get_stats
+        self.server = None
+        self.thread = None
+
+    def start(self):
+
+        get_stats = self.get_stats
+
+        class StatsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = json.dumps(get_stats(), sort_keys=True).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Don't write every request to stderr
+                pass
+
+        self.server = ThreadingHTTPServer((self.address, self.port), StatsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='StatsServer', daemon=True)
+        self.thread.start()
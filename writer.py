@@ -0,0 +1,184 @@
+import queue
+import threading
+import time
+
+from lineprotocol import make_line
+
+"""
+Decouples collecting points from writing them.  Poll tasks put each cycle's points on a bounded queue and a background
+thread writes them, so a slow or unreachable InfluxDB doesn't stretch the poll interval
+"""
+
+class QueuedWriter:
+
+    valid_overflow_policies = ['drop_oldest', 'block', 'spill']
+
+    def __init__(self, write_func, logger, hostname=None, max_size=100, overflow='drop_oldest', spool=None,
+                 replay_func=None, replay_batch_size=5000, replay_rate=0, extra_metrics=None):
+        """
+        :param write_func: Callable that writes a list of line protocol strings.  Returns True if everything was written
+        :param logger: send_log method of the main class
+        :param hostname: Host tag for the writer's own metrics
+        :param max_size: Max number of batches held in the queue
+        :param overflow: What to do with a new batch when the queue is full
+        :param spool: Spool that batches go to with the spill policy, and that is replayed once writes succeed
+        :param replay_func: Callable that writes a list of line protocol strings.  Returns True on success
+        :param replay_batch_size: Max number of lines replayed in a single write
+        :param replay_rate: Max number of points per second to replay.  0 is unlimited
+        :param extra_metrics: Callable returning a dict of more fields for the writer's metrics
+        """
+
+        self.write_func = write_func
+        self.send_log = logger
+        self.hostname = hostname
+        self.overflow = overflow
+        self.spool = spool
+        self.replay_func = replay_func
+        self.replay_batch_size = replay_batch_size
+        self.replay_rate = replay_rate
+        self.extra_metrics = extra_metrics
+        self.queue = queue.Queue(maxsize=max_size)
+        self.thread = None
+        self.replay_thread = None
+        self.replay_ready = threading.Event()
+
+        # Metrics
+        self.dropped_batches = 0
+        self.spilled_batches = 0
+        self.replayed_points = 0
+        self.written_points = 0
+        self.failed_writes = 0
+        # Seconds.  Kept a float so the field type never changes between points
+        self.write_latency = 0.0
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self._run, name='QueuedWriter', daemon=True)
+        self.thread.start()
+
+        if self.spool and self.replay_func:
+            self.replay_thread = threading.Thread(target=self._replay, name='SpoolReplay', daemon=True)
+            self.replay_thread.start()
+
+    def put(self, points):
+        """
+        Queue a batch of points to be written.  If the queue is full the overflow policy decides what happens.  With
+        the block policy this waits until there is room
+        :param points: List of line protocol strings.  They should already be timestamped since they may be written
+                       much later
+        :return: None
+        """
+
+        if self.overflow == 'block':
+            self.queue.put(points)
+            return
+
+        try:
+            self.queue.put_nowait(points)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == 'spill' and self.spool:
+            self._spill(points)
+            return
+
+        # drop_oldest
+        try:
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped_batches += 1
+            self.send_log('Write queue is full.  Dropped oldest batch', 'warning')
+        except queue.Empty:
+            pass
+
+        self.put(points)
+
+    def _spill(self, points):
+        """
+        Append a batch that doesn't fit in the queue to the spool.  It's replayed once the queue catches up
+        :param points: List of line protocol strings
+        :return: None
+        """
+
+        self.spilled_batches += 1
+        self.send_log('Write queue is full.  Spilling {} points to the spool', 'warning', len(points))
+        self.spool.append('\n'.join(points))
+        self.replay_ready.set()
+
+    def metrics(self):
+        """
+        :return: Dict describing the state of the writer
+        """
+
+        metrics = {
+            'dropped_batches': self.dropped_batches,
+            'failed_writes': self.failed_writes,
+            'queue_depth': self.queue.qsize(),
+            'replayed_points': self.replayed_points,
+            'spilled_batches': self.spilled_batches,
+            'write_latency': round(float(self.write_latency), 4),
+            'written_points': self.written_points,
+        }
+        if self.extra_metrics:
+            metrics.update(self.extra_metrics())
+
+        return metrics
+
+    def _metrics_point(self):
+        """
+        Build a point describing the state of the writer
+        :return: Line protocol string
+        """
+
+        return make_line('seedbox_collector', [('host', self.hostname)], sorted(self.metrics().items()),
+                         time.time_ns())
+
+    def _run(self):
+
+        while True:
+            points = self.queue.get()
+            points.append(self._metrics_point())
+
+            start = time.monotonic()
+            try:
+                if self.write_func(points):
+                    self.written_points += len(points)
+                    # InfluxDB is taking writes so anything spooled while it was down can go now
+                    self.replay_ready.set()
+                else:
+                    self.failed_writes += 1
+            except Exception as e:
+                self.failed_writes += 1
+                self.send_log('Writer failed to write batch: {}', 'error', e)
+            finally:
+                self.write_latency = time.monotonic() - start
+                self.queue.task_done()
+
+    def _replay(self):
+        """
+        Stream spooled points back to InfluxDB in the order they were spooled.  Runs after a successful write and
+        stops at the first failure, leaving the rest of the spool for next time
+        :return: None
+        """
+
+        while True:
+            self.replay_ready.wait()
+            self.replay_ready.clear()
+
+            while self.spool.has_data():
+                lines = self.spool.read(self.replay_batch_size)
+                if not lines:
+                    break
+
+                if not self.replay_func(lines):
+                    self.send_log('Failed to replay spooled points.  Will retry after the next successful write',
+                                  'warning')
+                    break
+
+                self.spool.commit()
+                self.replayed_points += len(lines)
+                self.send_log('Replayed {} spooled points', 'info', len(lines))
+
+                if self.replay_rate:
+                    time.sleep(len(lines) / self.replay_rate)